@@ -7,40 +7,85 @@ import { fileURLToPath } from 'url';
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
+// Persistent Python ML service (hybrid_recommender.py serve).
+// The model is loaded once and hot-reloaded by Python when it is retrained,
+// so each request only pays for the lookup instead of a process start.
+const ML_REQUEST_TIMEOUT_MS = 30000;
+let mlService = null;
+let mlRequestId = 0;
+const pendingMLRequests = new Map();
+
+const rejectPendingMLRequests = (error) => {
+  for (const [id, pending] of pendingMLRequests) {
+    clearTimeout(pending.timer);
+    pending.reject(error);
+    pendingMLRequests.delete(id);
+  }
+};
+
+const getMLService = () => {
+  if (mlService) return mlService;
+
+  const pythonScript = path.join(__dirname, '../python-ai/hybrid_recommender.py');
+  const serviceProcess = spawn('python', [pythonScript, 'serve']);
+  let buffer = '';
+
+  serviceProcess.stdout.on('data', (data) => {
+    buffer += data.toString();
+    let newlineIndex;
+    while ((newlineIndex = buffer.indexOf('\n')) !== -1) {
+      const line = buffer.slice(0, newlineIndex).trim();
+      buffer = buffer.slice(newlineIndex + 1);
+      if (!line) continue;
+
+      let response;
+      try {
+        response = JSON.parse(line);
+      } catch (e) {
+        console.error('[ML Service] Failed to parse Python output:', line);
+        continue;
+      }
+
+      const pending = pendingMLRequests.get(response.id);
+      if (!pending) continue;
+      pendingMLRequests.delete(response.id);
+      clearTimeout(pending.timer);
+      pending.resolve(response);
+    }
+  });
+
+  serviceProcess.stderr.on('data', (data) => {
+    console.log('[ML Service]', data.toString().trim());
+  });
+
+  const handleExit = (reason) => {
+    if (mlService === serviceProcess) mlService = null;
+    rejectPendingMLRequests(new Error(`Python ML service stopped: ${reason}`));
+  };
+  serviceProcess.on('error', (error) => handleExit(error.message));
+  serviceProcess.stdin.on('error', (error) => handleExit(error.message));
+  serviceProcess.on('close', (code) => handleExit(`exited with code ${code}`));
+
+  mlService = serviceProcess;
+  return serviceProcess;
+};
+
 // Helper function to call Python ML service
 const callPythonML = (command, inputData) => {
   return new Promise((resolve, reject) => {
-    const pythonScript = path.join(__dirname, '../python-ai/hybrid_recommender.py');
-    const pythonProcess = spawn('python', [pythonScript, command]);
-    
-    let stdout = '';
-    let stderr = '';
-    
-    pythonProcess.stdout.on('data', (data) => {
-      stdout += data.toString();
-    });
-    
-    pythonProcess.stderr.on('data', (data) => {
-      stderr += data.toString();
-    });
-    
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Python process exited with code ${code}: ${stderr}`));
-      } else {
-        try {
-          const result = JSON.parse(stdout);
-          resolve(result);
-        } catch (e) {
-          reject(new Error(`Failed to parse Python output: ${stdout}`));
-        }
-      }
-    });
-    
-    // Send input data to Python script
-    if (inputData) {
-      pythonProcess.stdin.write(JSON.stringify(inputData));
-      pythonProcess.stdin.end();
+    const id = ++mlRequestId;
+    const timer = setTimeout(() => {
+      pendingMLRequests.delete(id);
+      reject(new Error(`Python ML request timed out after ${ML_REQUEST_TIMEOUT_MS}ms`));
+    }, ML_REQUEST_TIMEOUT_MS);
+    pendingMLRequests.set(id, { resolve, reject, timer });
+
+    try {
+      getMLService().stdin.write(JSON.stringify({ ...inputData, id, command }) + '\n');
+    } catch (error) {
+      clearTimeout(timer);
+      pendingMLRequests.delete(id);
+      reject(error);
     }
   });
 };
@@ -331,6 +376,40 @@ export const getSimilarPackages = async (req, res, next) => {
   }
 };
 
+// Get ML service metrics (stage timings, shapes, fallback counts)
+export const getMLMetrics = async (req, res, next) => {
+  try {
+    const format = req.query.format === 'prometheus' ? 'prometheus' : 'json';
+    const result = await callPythonML('metrics', { format });
+
+    if (result.error) {
+      console.error('ML service error:', result.error);
+      return res.status(500).json({
+        success: false,
+        message: "Failed to read ML metrics",
+        error: result.error
+      });
+    }
+
+    if (format === 'prometheus') {
+      return res.status(200).type('text/plain; version=0.0.4').send(result.metrics);
+    }
+
+    res.status(200).json({
+      success: true,
+      message: "ML metrics retrieved successfully",
+      data: result.metrics
+    });
+  } catch (error) {
+    console.error('Error getting ML metrics:', error);
+    res.status(500).json({
+      success: false,
+      message: "Failed to read ML metrics",
+      error: error.message
+    });
+  }
+};
+
 // Train or retrain the ML model
 export const trainModel = async (req, res, next) => {
   try {
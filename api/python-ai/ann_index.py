@@ -0,0 +1,116 @@
+"""
+Approximate nearest-neighbour retrieval for large catalogues.
+
+IVFIndex is a pure-NumPy inverted-file index for maximum inner product
+search: vectors are clustered with k-means and each query only scores the
+vectors in the few clusters ("lists") whose centroids match it best, then
+the short list is re-ranked exactly. Query cost grows with
+n_probe x (vectors / n_lists) instead of with the catalogue size.
+
+Inner products with vectors of different norms (SVD / ALS package factors)
+are turned into a cosine problem by appending sqrt(max_norm^2 - |v|^2) to
+every vector before clustering; queries get a 0 in that dimension, so
+query . vector is unchanged. Unit-norm content embeddings are unaffected.
+
+The index is three arrays (saved with the model by model_store):
+    centroids   float32 (n_lists, dims)
+    offsets     int64   (n_lists + 1,)  list l holds items[offsets[l]:offsets[l+1]]
+    items       int32   (vectors,)      vector positions grouped by list
+"""
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+# Below this many vectors exact scoring (dense blocks in recommend_batch) is as
+# fast as the index; benchmark.py shows the index ahead from about 20,000 packages
+ANN_MIN_VECTORS = 20000
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a vector matrix (stored separately)."""
+
+    def __init__(self, centroids, offsets, items):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.items = items
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, random_state=42):
+        """Cluster vectors into n_lists lists (default: sqrt of the vector count)."""
+        n_vectors = len(vectors)
+        n_lists = max(1, min(n_lists or int(np.sqrt(n_vectors)), n_vectors))
+        points = _augment(np.asarray(vectors, dtype=np.float64))
+
+        kmeans = KMeans(n_clusters=n_lists, n_init=1, max_iter=25, random_state=random_state)
+        assignments = kmeans.fit_predict(points)
+        centroids = kmeans.cluster_centers_[:, :vectors.shape[1]]
+        return cls.from_assignments(centroids, assignments)
+
+    @classmethod
+    def from_assignments(cls, centroids, assignments):
+        """Index with each vector in the list given by assignments."""
+        items = np.argsort(assignments, kind='stable').astype(np.int32)
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(np.asarray(centroids, dtype=np.float32), offsets, items)
+
+    def add(self, vectors, first_new):
+        """Return a new index with vectors[first_new:] assigned to their best lists."""
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        assignments[self.items] = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        assignments[first_new:] = np.argmax(vectors[first_new:] @ self.centroids.T, axis=1)
+        return IVFIndex.from_assignments(self.centroids, assignments)
+
+    def probe(self, query, n_probe, min_items=0):
+        """
+        Positions of the vectors in the n_probe lists that best match query.
+
+        More lists are probed until at least min_items vectors are returned
+        (or every list has been probed).
+        """
+        order = np.argsort(-(self.centroids @ query))
+        sizes = np.diff(self.offsets)[order]
+        n_lists = max(n_probe, int(np.searchsorted(np.cumsum(sizes), min_items)) + 1)
+        return np.concatenate([
+            self.items[self.offsets[l]:self.offsets[l + 1]] for l in order[:n_lists]
+        ])
+
+    def search(self, vectors, query, k, n_probe=8, exclude=None):
+        """
+        Approximate top-k rows of vectors by inner product with query.
+
+        Candidates from the probed lists are scored exactly against vectors.
+        Returns (positions, scores) sorted by descending score.
+        """
+        extra = 0 if exclude is None else len(exclude)
+        candidates = self.probe(query, n_probe, min_items=k + extra)
+        if exclude is not None and len(exclude) > 0:
+            candidates = candidates[~np.isin(candidates, exclude)]
+        scores = vectors[candidates] @ query
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return candidates[top], scores[top]
+
+    def arrays(self, prefix):
+        """Arrays for model_store, named <prefix>_centroids/_offsets/_items."""
+        return {
+            f'{prefix}_centroids': self.centroids,
+            f'{prefix}_offsets': self.offsets,
+            f'{prefix}_items': self.items,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        """Index stored by arrays(prefix), or None if the model has none."""
+        if f'{prefix}_centroids' not in arrays:
+            return None
+        return cls(arrays[f'{prefix}_centroids'], arrays[f'{prefix}_offsets'], arrays[f'{prefix}_items'])
+
+
+def _augment(vectors):
+    """Append sqrt(max_norm^2 - |v|^2) and scale to unit norm, so MIPS becomes cosine search."""
+    norms = np.linalg.norm(vectors, axis=1)
+    max_norm = norms.max() if len(norms) and norms.max() > 0 else 1.0
+    extra = np.sqrt(np.maximum(max_norm ** 2 - norms ** 2, 0.0))
+    return np.hstack([vectors, extra[:, None]]) / max_norm
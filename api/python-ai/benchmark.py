@@ -0,0 +1,322 @@
+"""
+Benchmark training and serving of the Hybrid Recommendation Model
+Uses ML/recommender_dataset, optionally scaled up synthetically
+
+Usage:
+    python benchmark.py [--scales 1 10 100] [--queries 1000] [--output results.json]
+
+Each scale runs in a fresh process, so peak RSS is measured per scale.
+Results are written as JSON for comparing runs.
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from hybrid_recommender import HybridRecommender
+import model_store
+from metrics import REGISTRY
+from factorization import FACTORIZATIONS
+from text_embeddings import parse_embedding_column
+from csv_loader import load_dataset_csv, load_dataset_events, TRAINING_COLUMNS
+
+DATA_DIR = Path(__file__).parent.parent.parent / 'ML' / 'recommender_dataset'
+
+def load_dataset(data_dir=DATA_DIR):
+    """Load the users, packages and events columns training uses (typed, via the cached copies)."""
+    return (load_dataset_csv(data_dir, 'users.csv', columns=TRAINING_COLUMNS['users.csv']),
+            load_dataset_csv(data_dir, 'packages.csv', columns=TRAINING_COLUMNS['packages.csv']),
+            load_dataset_events(data_dir))
+
+def scale_dataset(users_df, packages_df, events_df, factor, seed=42):
+    """
+    Scale the dataset by an integer factor.
+
+    Users and packages are copied `factor` times with suffixed ids. Each copy
+    of an event keeps its user copy, but a quarter of them point at a
+    package in the next copy, so the copies stay connected. Copied package
+    embeddings get small Gaussian noise so similarity ties are not exact.
+
+    Parameters:
+    -----------
+    factor : int
+        Number of copies (1 returns the data unchanged)
+    seed : int
+        Random seed for the cross links and embedding noise
+    """
+    if factor <= 1:
+        return users_df, packages_df, events_df
+
+    rng = np.random.default_rng(seed)
+    copies = np.arange(factor)
+
+    def suffixed(ids, copy_numbers):
+        # Missing ids (e.g. searches without a package) stay missing
+        suffixes = pd.Series(np.char.mod('~%d', copy_numbers), index=ids.index)
+        return (ids.astype(str) + suffixes).where(ids.notna())
+
+    users = users_df.loc[users_df.index.repeat(factor)].reset_index(drop=True)
+    users['user_id'] = suffixed(users['user_id'], np.tile(copies, len(users_df)))
+
+    packages = packages_df.loc[packages_df.index.repeat(factor)].reset_index(drop=True)
+    package_copies = np.tile(copies, len(packages_df))
+    packages['package_id'] = suffixed(packages['package_id'], package_copies)
+    embeddings = parse_embedding_column(packages['text_embedding']).astype(np.float64)
+    noise = rng.normal(0, 0.05 * embeddings.std(), embeddings.shape)
+    embeddings[package_copies > 0] += noise[package_copies > 0]
+    packages['text_embedding'] = [json.dumps(row) for row in np.round(embeddings, 4).tolist()]
+
+    events = events_df.loc[events_df.index.repeat(factor)].reset_index(drop=True)
+    user_copies = np.tile(copies, len(events_df))
+    package_copies = (user_copies + (rng.random(len(events)) < 0.25)) % factor
+    events['user_id'] = suffixed(events['user_id'], user_copies)
+    events['package_id'] = suffixed(events['package_id'], package_copies)
+    return users, packages, events
+
+def load_ranking_examples(scale, data_dir=DATA_DIR):
+    """ranking_examples.csv with ids of the first dataset copy (see scale_dataset), or None."""
+    path = data_dir / 'ranking_examples.csv'
+    if not path.exists():
+        return None
+    examples = pd.read_csv(path)
+    if scale > 1:
+        examples['user_id'] = examples['user_id'].astype(str) + '~0'
+        examples['package_id'] = examples['package_id'].astype(str) + '~0'
+    return examples
+
+def latency_stats(latencies):
+    """Summarise per-call latencies (seconds) as milliseconds and calls per second."""
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'calls': len(latencies),
+        'mean_ms': round(latencies.mean() * 1000, 4),
+        'p50_ms': round(p50, 4),
+        'p95_ms': round(p95, 4),
+        'p99_ms': round(p99, 4),
+        'max_ms': round(latencies.max() * 1000, 4),
+        'throughput_per_s': round(len(latencies) / latencies.sum(), 1)
+    }
+
+def time_calls(fn, arguments):
+    """Call fn once per argument and return the latency of each call in seconds."""
+    latencies = np.empty(len(arguments))
+    for i, argument in enumerate(arguments):
+        started = time.perf_counter()
+        fn(argument)
+        latencies[i] = time.perf_counter() - started
+    return latencies
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_benchmark(scale, queries=1000, seed=42, factorization='svd', rank=20):
+    """Train, save, load and query the model on the dataset scaled by `scale`."""
+    result = {'scale': scale, 'factorization': factorization, 'rank': rank}
+
+    started = time.perf_counter()
+    users_df, packages_df, events_df = scale_dataset(*load_dataset(), scale, seed=seed)
+    result['dataset'] = {
+        'users': len(users_df),
+        'packages': len(packages_df),
+        'events': len(events_df),
+        'prepare_seconds': round(time.perf_counter() - started, 4)
+    }
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        recommender = HybridRecommender(model_dir=model_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            recommender.train(users_df, packages_df, events_df, factorization=factorization, rank=rank)
+            train_seconds = time.perf_counter() - started
+        result['train'] = {
+            'seconds': round(train_seconds, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in recommender.train_timings.items()},
+            'users': len(recommender.user_ids),
+            'packages': len(recommender.package_ids)
+        }
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            recommender.save_model()
+            save_seconds = time.perf_counter() - started
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            served = HybridRecommender(model_dir=model_dir)
+            started = time.perf_counter()
+            served.load_model()
+            load_seconds = time.perf_counter() - started
+        result['model'] = {
+            'size_mb': round(model_store.version_size(served.model_path) / (1024 * 1024), 3),
+            'save_seconds': round(save_seconds, 4),
+            'load_seconds': round(load_seconds, 4)
+        }
+
+        rng = np.random.default_rng(seed)
+        user_sample = rng.choice(served.user_ids.ids, size=queries).tolist()
+        package_sample = rng.choice(served.content_ids.ids, size=queries).tolist()
+
+        # Warm up once so lazy page faults on the mapped arrays are not counted
+        served.recommend(user_sample[0])
+        served.get_similar_packages(package_sample[0])
+
+        result['recommend'] = latency_stats(time_calls(lambda user_id: served.recommend(user_id, n=5), user_sample))
+        result['similar'] = latency_stats(
+            time_calls(lambda package_id: served.get_similar_packages(package_id, n=5), package_sample)
+        )
+
+        started = time.perf_counter()
+        served.recommend_batch(served.user_ids.ids.tolist(), n=5)
+        batch_seconds = time.perf_counter() - started
+        result['recommend_batch'] = {
+            'users': len(served.user_ids),
+            'seconds': round(batch_seconds, 4),
+            'users_per_s': round(len(served.user_ids) / batch_seconds, 1)
+        }
+
+        # Second stage: fit the ranker, then time the same calls with re-ranking
+        examples = load_ranking_examples(scale)
+        if examples is not None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                served.fit_ranker(examples)
+                result['ranker_fit_seconds'] = round(time.perf_counter() - started, 4)
+            result['recommend_reranked'] = latency_stats(
+                time_calls(lambda user_id: served.recommend(user_id, n=5), user_sample)
+            )
+            started = time.perf_counter()
+            served.recommend_batch(served.user_ids.ids.tolist(), n=5)
+            batch_seconds = time.perf_counter() - started
+            result['recommend_batch_reranked'] = {
+                'users': len(served.user_ids),
+                'seconds': round(batch_seconds, 4),
+                'users_per_s': round(len(served.user_ids) / batch_seconds, 1)
+            }
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['metrics'] = REGISTRY.snapshot()
+    return result
+
+def _run_in_child(scale, options, results):
+    try:
+        results.put(run_benchmark(scale, **options))
+    except Exception as e:
+        results.put({'scale': scale, 'error': f'{type(e).__name__}: {e}'})
+
+def run_isolated(scale, **options):
+    """Run one scale in a fresh process so its peak RSS is not shared with other runs."""
+    import queue
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_in_child, args=(scale, options, results))
+    process.start()
+    # Read before join: a large result would otherwise block the child on the queue.
+    # Poll so a child killed without reporting (e.g. out of memory) is noticed.
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1.0)
+        except queue.Empty:
+            if not process.is_alive():
+                result = {'scale': scale, 'error': 'Process exited without a result'}
+    process.join()
+    if process.exitcode and 'error' not in result:
+        result['error'] = f'Process exited with code {process.exitcode}'
+    return result
+
+def print_result(result):
+    """Print a human-readable summary of one scale."""
+    print(f"\n[scale {result['scale']}x, {result.get('factorization', 'svd')}]")
+    if 'error' in result:
+        print(f"❌ {result['error']}")
+        return
+    dataset = result['dataset']
+    print(f"  Data: {dataset['users']} users, {dataset['packages']} packages, {dataset['events']} events")
+    stages = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in result['train']['stages'].items())
+    print(f"  Train: {result['train']['seconds']:.3f}s ({stages})")
+    model = result['model']
+    print(f"  Model: {model['size_mb']:.2f} MB, save {model['save_seconds']:.3f}s, load {model['load_seconds']:.3f}s")
+    for name in ('recommend', 'recommend_reranked', 'similar'):
+        if name not in result:
+            continue
+        stats = result[name]
+        print(f"  {name}: p50 {stats['p50_ms']:.3f} ms, p95 {stats['p95_ms']:.3f} ms, "
+              f"p99 {stats['p99_ms']:.3f} ms ({stats['throughput_per_s']:.0f}/s)")
+    batch = result['recommend_batch']
+    print(f"  recommend_batch: {batch['users']} users in {batch['seconds']:.3f}s ({batch['users_per_s']:.0f}/s)")
+    if 'recommend_batch_reranked' in result:
+        batch = result['recommend_batch_reranked']
+        print(f"  recommend_batch_reranked: {batch['users']} users in {batch['seconds']:.3f}s "
+              f"({batch['users_per_s']:.0f}/s), ranker fit {result['ranker_fit_seconds']:.3f}s")
+    if result['peak_rss_mb'] is not None:
+        print(f"  Peak RSS: {result['peak_rss_mb']:.1f} MB")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark training and serving on ML/recommender_dataset')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1],
+                        help='Dataset scale factors to run, e.g. 1 10 100 (default: 1)')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='recommend/similar calls timed per scale (default: 1000)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--factorization', choices=sorted(FACTORIZATIONS), default='svd',
+                        help='Collaborative filtering backend to train (default: svd)')
+    parser.add_argument('--rank', type=int, default=20, help='Number of latent factors')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("BENCHMARKING HYBRID RECOMMENDATION MODEL")
+    print("=" * 80)
+
+    runs = []
+    for scale in args.scales:
+        result = run_isolated(scale, queries=args.queries, seed=args.seed,
+                              factorization=args.factorization, rank=args.rank)
+        print_result(result)
+        runs.append(result)
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'queries': args.queries,
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+    return all('error' not in run for run in runs)
+
+if __name__ == '__main__':
+    try:
+        success = main()
+        sys.exit(0 if success else 1)
+    except Exception as e:
+        print(f"\n❌ Error running benchmark: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
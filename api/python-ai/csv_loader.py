@@ -0,0 +1,217 @@
+"""
+Typed CSV loading with a cached columnar copy.
+
+The dataset CSVs (ML/recommender_dataset) are read with declared dtypes
+instead of inferred ones: ids and event types become categoricals, numeric
+columns are float64 and timestamps are parsed once to UTC datetimes. Only
+the columns a caller asks for are read, with pandas' pyarrow CSV engine.
+
+The typed frame is written next to the CSV as Parquet, and later loads read
+that instead of parsing the CSV for as long as the CSV's size and mtime are
+unchanged and the copy holds the requested columns:
+
+    events.csv
+    events.typed.parquet    <- typed columns; metadata records the CSV size/mtime
+"""
+
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from event_store import EventStore
+
+EVENT_DTYPES = {
+    'userId': 'category',
+    'eventType': 'category',
+    'packageId': 'category',
+    'sessionTime': 'float64',
+    'paid': 'float64',
+    'sessionDuration': 'float64',
+    'timestamp': 'datetime',
+    'query_text': 'str',
+    'filters': 'str',
+    'resultsCount': 'float64',
+    'rating': 'float64',
+    'review_text': 'str',
+    'educatorId': 'category',
+    'messageCount': 'float64',
+    'lastMessageAt': 'datetime',
+}
+
+USER_DTYPES = {
+    'userId': 'category',
+    'age': 'float64',
+    'country': 'category',
+    'language': 'category',
+    'educationLevel': 'category',
+    'isEducator': 'float64',
+    'createdAt': 'datetime',
+    'learningPreferences_subjects': 'str',
+    'learningStyle': 'category',
+    'academicLevel': 'category',
+    'timePreferences': 'category',
+    'aiFeatures_interactionCount': 'float64',
+    'aiFeatures_lastActive': 'datetime',
+}
+
+PACKAGE_DTYPES = {
+    'packageId': 'category',
+    'educatorId': 'category',
+    'title': 'str',
+    'description': 'str',
+    'keywords': 'str',
+    'subject': 'category',
+    'academicLevel': 'category',
+    'languages': 'str',
+    'price': 'float64',
+    'currency': 'category',
+    'sessions': 'float64',
+    'duration': 'float64',
+    'thumbnail': 'str',
+    'packageCategory': 'category',
+    'isFeatured': 'float64',
+    'createdAt': 'datetime',
+    'availability': 'str',
+    'avgRating': 'float64',
+    'totalReviews': 'float64',
+    'educatorIsPro': 'float64',
+    'educatorResponseTime': 'float64',
+    'educatorAvgRating': 'float64',
+    'educatorSubjects': 'str',
+    'educatorLocation': 'category',
+    'text_embedding': 'str',
+}
+
+# data/interactions.csv (scripts/export-to-csv.js)
+INTERACTION_DTYPES = {
+    'user_id': 'category',
+    'package_id': 'category',
+    'interaction_type': 'category',
+    'timestamp': 'datetime',
+    'package_title': 'str',
+    'package_subject': 'category',
+    'package_price': 'float64',
+}
+
+# camelCase export columns -> the model's column names
+RENAMES = {'userId': 'user_id', 'eventType': 'event_type', 'packageId': 'package_id'}
+
+# Columns training needs (CSV names); languages, subjects, price, sessions and avgRating feed the re-ranker
+TRAINING_COLUMNS = {
+    'events.csv': ['userId', 'eventType', 'packageId', 'timestamp'],
+    'users.csv': ['userId', 'language', 'learningPreferences_subjects'],
+    'packages.csv': ['packageId', 'title', 'subject', 'languages', 'price', 'sessions', 'avgRating',
+                     'text_embedding'],
+}
+
+DATASET_DTYPES = {'events.csv': EVENT_DTYPES, 'users.csv': USER_DTYPES, 'packages.csv': PACKAGE_DTYPES}
+
+
+def cache_path(csv_path):
+    """Path of the typed Parquet copy of a CSV."""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(f'{csv_path.stem}.typed.parquet')
+
+
+def read_typed_csv(csv_path, dtypes, columns=None, cache=True):
+    """
+    Read a CSV with declared dtypes, via its typed Parquet copy when current.
+
+    Parameters:
+    -----------
+    csv_path : str or Path
+    dtypes : dict
+        dtype per column: 'category', 'float64', 'str' or 'datetime'
+        (parsed as ISO 8601, UTC). Columns not listed are read as strings.
+    columns : list or None
+        Columns to read (default: all). Columns missing from the CSV are skipped.
+    cache : bool
+        Read and write the Parquet copy next to the CSV
+
+    Returns:
+    --------
+    DataFrame with the requested columns in CSV order
+    """
+    csv_path = Path(csv_path)
+    header = list(pd.read_csv(csv_path, nrows=0).columns)
+    wanted = [c for c in header if columns is None or c in columns]
+    stat = csv_path.stat()
+    key = {'csv_size': stat.st_size, 'csv_mtime_ns': stat.st_mtime_ns}
+
+    cached_columns = _cached_columns(cache_path(csv_path), key) if cache else None
+    if cached_columns is not None and set(wanted) <= set(cached_columns):
+        return pd.read_parquet(cache_path(csv_path), columns=wanted)
+
+    # Re-read what the copy already held too, so callers wanting fewer columns still hit it
+    read = [c for c in header if c in wanted or c in (cached_columns or ())]
+    df = _parse_csv(csv_path, read, dtypes)
+    if cache:
+        _write_cache(cache_path(csv_path), df, key)
+    return df[wanted]
+
+
+def load_dataset_csv(data_dir, name, columns=None, cache=True):
+    """
+    Load one of users.csv / packages.csv / events.csv with model column names.
+
+    columns are CSV names (default: all); TRAINING_COLUMNS[name] reads only
+    what training uses.
+    """
+    df = read_typed_csv(Path(data_dir) / name, DATASET_DTYPES[name], columns=columns, cache=cache)
+    return df.rename(columns={k: v for k, v in RENAMES.items() if k in df.columns})
+
+
+def load_dataset_events(data_dir, cache=True):
+    """
+    Training columns of events.csv plus the events merged into the dataset's
+    event store (data_dir/event_store, see merge_real_data.py), if it has one.
+    """
+    events_df = load_dataset_csv(data_dir, 'events.csv', columns=TRAINING_COLUMNS['events.csv'], cache=cache)
+    store_dir = Path(data_dir) / 'event_store'
+    if not store_dir.exists():
+        return events_df
+    merged = EventStore(store_dir).read(columns=list(events_df.columns))
+    return pd.concat([events_df, merged], ignore_index=True) if len(merged) else events_df
+
+
+def _parse_csv(csv_path, columns, dtypes):
+    """Parse the given columns of a CSV with the pyarrow engine and apply dtypes."""
+    read_dtypes = {c: ('str' if dtypes.get(c, 'str') == 'datetime' else dtypes.get(c, 'str'))
+                   for c in columns}
+    df = pd.read_csv(csv_path, engine='pyarrow', usecols=columns, dtype=read_dtypes)
+    for column in columns:
+        if dtypes.get(column) == 'datetime':
+            df[column] = pd.to_datetime(df[column], errors='coerce', utc=True, format='ISO8601')
+    return df
+
+
+def _cached_columns(path, key):
+    """Columns of the typed copy at path if it was written for key, else None."""
+    import pyarrow.parquet as pq
+
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except OSError:
+        return None
+    stored = json.loads(metadata.get(b'focusdesk_csv', b'{}'))
+    if {k: stored.get(k) for k in key} != key:
+        return None
+    return stored.get('columns')
+
+
+def _write_cache(path, df, key):
+    """Write df to path as Parquet tagged with key; a read-only directory just skips it."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tag = json.dumps({**key, 'columns': list(df.columns)}).encode()
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'focusdesk_csv': tag})
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
@@ -0,0 +1,158 @@
+"""
+Local append-only store of exported interaction events.
+
+Events are kept as Parquet part files, one per export run and source
+collection, next to a watermark file recording the newest exported
+timestamp per collection:
+
+    data/event_store/
+        watermarks.json
+        parts/
+            20261017T010203123456Z-activities.parquet
+            20261017T010203123456Z-bookings.parquet
+
+Incremental exports only fetch documents newer than the watermark and add
+a new part; training reads the whole history from the local parts instead
+of re-scanning the production collections. merge_real_data.py keeps a
+store of the same layout in ML/recommender_dataset/event_store/ for real
+events merged into the CSV dataset, appending only events it has not seen.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+EVENT_COLUMNS = ['user_id', 'event_type', 'package_id', 'timestamp', 'weight']
+
+# Columns that identify one event when deduplicating
+EVENT_KEY_COLUMNS = ['user_id', 'package_id', 'event_type', 'timestamp']
+
+
+def event_schema():
+    """Arrow schema of stored event parts."""
+    import pyarrow as pa
+
+    return pa.schema([
+        ('user_id', pa.string()),
+        ('event_type', pa.string()),
+        ('package_id', pa.string()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('weight', pa.float64())
+    ])
+
+
+def write_event_chunks(chunks, path):
+    """Write event DataFrame chunks to one Parquet file as they arrive; returns the row count."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Writing events to Parquet requires pyarrow (pip install pyarrow)") from e
+
+    schema = event_schema()
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            chunk = chunk[EVENT_COLUMNS].astype({'event_type': object})
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+
+def event_keys(events_df):
+    """uint64 hash per event of its (user_id, package_id, event_type, timestamp)."""
+    keys = pd.DataFrame({
+        column: events_df[column].astype(object) for column in EVENT_KEY_COLUMNS[:3]
+    })
+    keys['timestamp'] = pd.to_datetime(
+        events_df['timestamp'], errors='coerce', utc=True, format='ISO8601'
+    ).astype('datetime64[us, UTC]')
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+
+class EventStore:
+    """Append-only Parquet event parts plus per-source watermarks."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.parts_dir = self.root / 'parts'
+        self.watermarks_path = self.root / 'watermarks.json'
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+
+    def watermarks(self):
+        """Newest stored timestamp per source, as UTC pandas Timestamps."""
+        try:
+            with open(self.watermarks_path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {source: pd.Timestamp(value) for source, value in stored.items()}
+
+    def save_watermarks(self, watermarks):
+        """Persist watermarks atomically (merged with the existing ones)."""
+        stored = {source: value.isoformat() for source, value in self.watermarks().items()}
+        stored.update({source: pd.Timestamp(value).isoformat() for source, value in watermarks.items()})
+        tmp_path = self.watermarks_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(stored, f, indent=2)
+        os.replace(tmp_path, self.watermarks_path)
+
+    def append_chunks(self, chunks, source):
+        """
+        Write chunks as a new part for source; returns the number of rows.
+
+        The part is written under a hidden temporary name and renamed into
+        place, so readers never see a partial file. Empty parts are dropped.
+        """
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        tmp_path = self.parts_dir / f'.{stamp}-{source}.parquet.tmp'
+        try:
+            rows = write_event_chunks(chunks, tmp_path)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        if rows == 0:
+            tmp_path.unlink(missing_ok=True)
+        else:
+            os.replace(tmp_path, self.parts_dir / f'{stamp}-{source}.parquet')
+        return rows
+
+    def append(self, events_df, source):
+        """Add a DataFrame of events as a new part."""
+        return self.append_chunks([events_df], source)
+
+    def append_new(self, events_df, source, existing_df=None):
+        """
+        Add only events not seen before as a new part; returns the number added.
+
+        An event is a duplicate if its EVENT_KEY_COLUMNS match a stored event,
+        a row of existing_df, or an earlier row of events_df, so appending the
+        same events twice adds nothing the second time.
+        """
+        seen = [event_keys(self.read(columns=EVENT_KEY_COLUMNS))]
+        if existing_df is not None:
+            seen.append(event_keys(existing_df))
+        keys = event_keys(events_df)
+        is_new = ~np.isin(keys, np.concatenate(seen)) & ~pd.Series(keys).duplicated().to_numpy()
+        return self.append(events_df[is_new], source)
+
+    def part_paths(self):
+        """Committed part files, oldest first."""
+        return sorted(self.parts_dir.glob('*.parquet'))
+
+    def read(self, columns=None):
+        """All stored events as one DataFrame (event_type as a categorical)."""
+        paths = self.part_paths()
+        if not paths:
+            return pd.DataFrame(columns=columns or EVENT_COLUMNS)
+        events_df = pd.concat(
+            [pd.read_parquet(path, columns=columns) for path in paths], ignore_index=True
+        )
+        if 'event_type' in events_df.columns:
+            events_df['event_type'] = events_df['event_type'].astype('category')
+        return events_df
@@ -5,144 +5,697 @@ Combines Collaborative Filtering and Content-Based Filtering
 
 import sys
 import json
+import functools
+import threading
+from collections import OrderedDict
+import time
 import numpy as np
 import pandas as pd
-from sklearn.decomposition import TruncatedSVD
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
 import pickle
 import os
 from pathlib import Path
 
+import model_store
+from factorization import FACTORIZATIONS, als_confidence, als_solve
+from id_encoder import IdEncoder
+from ann_index import IVFIndex, ANN_MIN_VECTORS
+from interaction_weights import weight_interactions, event_type_weights
+from metrics import REGISTRY
+from text_embeddings import parse_embedding_column
+from reranker import (LinearRanker, RANKING_FEATURES, ORIGIN_FEATURES, LABEL_FEATURES, PACKAGE_FEATURES,
+                      package_feature_matrix, recent_event_counts, label_masks, label_overlap_features)
+
+# Interaction weight per event type (unknown types count as DEFAULT_EVENT_WEIGHT)
+EVENT_WEIGHTS = {
+    'booking': 1.0,
+    'start_booking': 1.0,
+    'click': 0.2,
+    'view': 0.05,
+    'search': 0.05,
+    'rating': 0.3,
+    'message': 0.05
+}
+DEFAULT_EVENT_WEIGHT = 0.05
+
+def _timed(method):
+    """Record the wall time of each call in the request_seconds histogram."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer('request_seconds', method=method):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class HybridRecommender:
     """
     Hybrid recommendation system combining collaborative and content-based filtering.
     """
     
-    def __init__(self, model_dir='models'):
-        """Initialize the recommender with model directory."""
+    def __init__(self, model_dir='models', metrics=None):
+        """
+        Initialize the recommender with model directory.
+        
+        Timings, matrix shapes and fallback counts go to `metrics` (the
+        process-wide metrics.REGISTRY by default), never to stdout.
+        """
         self.model_dir = Path(__file__).parent / model_dir
         self.model_dir.mkdir(exist_ok=True)
+        self.model_path = self.model_dir / 'hybrid_model'
+        self.legacy_model_path = self.model_dir / 'hybrid_model.pkl'
+        self.model_version = None
         
         # Model components
-        self.svd = None
-        self.interaction_matrix = None
-        self.predicted_scores_df = None
-        self.content_similarity_df = None
+        self.interaction_matrix = None  # scipy.sparse CSR, users x packages
+        self.user_anchors = None        # int32 users x n_anchors, strongest interactions first (-1 padded)
+        self.user_anchor_weights = None # interaction weight of each anchor
+        self.n_anchors = 1
+        self.user_ids = None            # IdEncoder: user id <-> interaction row
+        self.package_ids = None         # IdEncoder: package id <-> interaction column
+        self.user_factors = None
+        self.package_factors = None
+        self.content_ids = None         # IdEncoder: package id <-> content row
+        self.content_embeddings = None  # L2-normalised, one row per package
+        self.neighbour_indices = None   # int32, packages x K, most similar first
+        self.neighbour_scores = None    # float32, packages x K
         self.packages_df = None
+        self.package_lookup = {}  # package_id -> display fields for results
+        self.popular_indices = None     # package positions, most popular first
+        self.popular_scores = None
+        self.popular_by_subject = {}    # subject -> ranks into popular_indices
+        self.popularity_half_life_days = None
+        self.interaction_weighting = {}       # half_life_days, type_caps, burst_seconds
+        self.interaction_reference_time = None  # time interaction weights are decayed to
+        self.popularity_reference_time = None  # newest event seen by the decay
+        self.n_neighbours = 50
+        self.factorization = {'method': 'svd'}  # backend name, rank and parameters
+        self.factor_index = None        # IVFIndex over package_factors (large catalogues)
+        self.content_index = None       # IVFIndex over content_embeddings
+        self.ann_probes = 8             # lists probed per index query
+        self.ann_candidates = 200       # candidates re-ranked exactly per query
+        self.package_content_positions = None  # content row of each package (-1 if none)
+        self.content_package_positions = None  # package column of each content row (-1 if none)
+        self.package_features = None    # float32 content rows x reranker.PACKAGE_FEATURES (NaN if unknown)
+        self.user_label_masks = None    # int64 users x reranker.LABEL_FEATURES label sets (-1 if unknown)
+        self.package_label_masks = None  # int64 content rows x reranker.LABEL_FEATURES label sets
+        self.label_vocabularies = {}    # label feature -> labels, in mask bit order
+        self.ranker = None              # reranker.LinearRanker re-ordering recommend candidates
+        self.ranker_candidates = 50     # candidates per list (collaborative, content, popular) re-ranked
         
         # Event weights
-        self.event_weights = {
-            'booking': 1.0,
-            'start_booking': 1.0,
-            'click': 0.2,
-            'view': 0.05,
-            'search': 0.05,
-            'rating': 0.3,
-            'message': 0.05
-        }
+        self.event_weights = dict(EVENT_WEIGHTS)
+        self.train_timings = {}  # stage -> seconds of the last train()
+        self.metrics = metrics if metrics is not None else REGISTRY
         
-    def train(self, users_df, packages_df, events_df):
+    def train(self, users_df, packages_df, events_df, sparse=True, n_neighbours=50,
+              popularity_half_life_days=None, factorization='svd', rank=20, factorization_params=None,
+              ann_index=None, interaction_half_life_days=None, event_type_caps=None,
+              burst_window_seconds=None, n_anchors=1, embeddings=None):
         """
         Train the hybrid recommendation model.
         
+        Only the user and package factor matrices are kept; each user's
+        collaborative scores are computed at request time as one dot product.
+        
         Parameters:
         -----------
         users_df : DataFrame with user data
-        packages_df : DataFrame with package data (must have text_embedding column)
+        packages_df : DataFrame with package data (text_embedding column
+            unless embeddings is given)
         events_df : DataFrame with user interaction events
+        sparse : bool
+            Fit the factorization on the scipy.sparse CSR interaction matrix
+            (default). Set to False to fit on the equivalent dense array.
+        n_neighbours : int
+            Number of most similar packages kept per package for
+            `get_similar_packages` (default: 50)
+        popularity_half_life_days : float or None
+            If set, cold-start popularity decays event weights by age
+            (relative to the newest event) with this half-life
+        factorization : str
+            Collaborative filtering backend from factorization.FACTORIZATIONS:
+            'svd' (default), 'randomized_svd' or 'als'
+        rank : int
+            Number of latent factors (default: 20, capped at packages - 1)
+        factorization_params : dict or None
+            Extra backend arguments, e.g. {'iterations': 15, 'alpha': 40,
+            'n_jobs': 4} for 'als'
+        ann_index : bool or None
+            Build IVF indexes over package factors and content embeddings so
+            recommend scores a short candidate list instead of the whole
+            catalogue. None (default) builds them once the catalogue has
+            ann_index.ANN_MIN_VECTORS packages. The similar-package table stays
+            exact; it is computed offline and served by lookup
+        interaction_half_life_days : float or None
+            If set, interaction weights decay by event age (relative to the
+            newest event) with this half-life
+        event_type_caps : dict or None
+            Maximum summed weight of one event type per (user, package),
+            e.g. {'view': 0.25}
+        burst_window_seconds : float or None
+            Count repeats of the same event on the same package less than
+            this many seconds apart once
+        n_anchors : int
+            Content scores compare packages with the weighted mean embedding
+            of the user's n_anchors strongest interactions (default: 1, the
+            single strongest). With interaction_half_life_days the weights
+            already combine event weight and recency
+        embeddings : array or None
+            Package embeddings as one (packages, dims) matrix in packages_df
+            row order, e.g. from text_embeddings.load_package_embeddings;
+            default parses the text_embedding column
         """
+        if factorization not in FACTORIZATIONS:
+            raise ValueError(f"Unknown factorization '{factorization}'; "
+                             f"choose from {', '.join(FACTORIZATIONS)}")
         print("Training Hybrid Recommendation Model...")
+        self.train_timings = {}
+        lap = _stopwatch(self.train_timings, self.metrics)
         
         # Store packages data
         self.packages_df = packages_df.copy()
+        self.package_lookup = _package_lookup(packages_df)
         
         # 1. Parse text embeddings
         print("  [1/4] Parsing text embeddings...")
-        if 'text_embedding' in packages_df.columns:
-            packages_df['embedding_vector'] = packages_df['text_embedding'].apply(
-                lambda x: np.array(json.loads(x)) if isinstance(x, str) else np.array(x)
-            )
-        else:
-            # Create dummy embeddings if not available
-            packages_df['embedding_vector'] = [np.random.randn(16) for _ in range(len(packages_df))]
+        embedding_matrix = embeddings if embeddings is not None else _parse_embeddings(packages_df)
+        lap('parse_embeddings')
         
         # 2. Build interaction matrix
         print("  [2/4] Building interaction matrix...")
-        events_df['weight'] = events_df['event_type'].map(self.event_weights).fillna(0.05)
-        interaction_scores = events_df.groupby(['user_id', 'package_id'])['weight'].sum().reset_index()
-        interaction_scores.columns = ['user_id', 'package_id', 'score']
-        
-        self.interaction_matrix = interaction_scores.pivot(
-            index='user_id',
-            columns='package_id',
-            values='score'
-        ).fillna(0)
-        
-        # 3. Train collaborative filtering (SVD)
-        print("  [3/4] Training collaborative filtering model...")
-        self.svd = TruncatedSVD(n_components=min(20, self.interaction_matrix.shape[1] - 1), random_state=42)
-        user_factors = self.svd.fit_transform(self.interaction_matrix)
-        package_factors = self.svd.components_.T
-        
-        predicted_scores = np.dot(user_factors, package_factors.T)
-        self.predicted_scores_df = pd.DataFrame(
-            predicted_scores,
-            index=self.interaction_matrix.index,
-            columns=self.interaction_matrix.columns
+        events_df['weight'] = self._event_type_weights(events_df)
+        self.interaction_weighting = {
+            'half_life_days': interaction_half_life_days,
+            'type_caps': dict(event_type_caps or {}),
+            'burst_seconds': burst_window_seconds
+        }
+        weighted = weight_interactions(events_df, self.event_weights, DEFAULT_EVENT_WEIGHT,
+                                       **self.interaction_weighting)
+        self.interaction_matrix = weighted.to_csr()
+        self.user_ids, self.package_ids = weighted.user_ids, weighted.package_ids
+        self.interaction_reference_time = weighted.reference_time
+        self.n_anchors = n_anchors
+        self._select_anchors()
+        lap('interaction_matrix')
+        self._build_popularity(events_df, half_life_days=popularity_half_life_days)
+        lap('popularity')
+        
+        # 3. Train collaborative filtering
+        print(f"  [3/4] Training collaborative filtering model ({factorization})...")
+        params = dict(factorization_params or {})
+        if factorization == 'svd':
+            params.setdefault('sparse', sparse)
+        rank = min(rank, self.interaction_matrix.shape[1] - 1)
+        self.user_factors, self.package_factors = FACTORIZATIONS[factorization](
+            self.interaction_matrix, rank, **params
         )
+        self.factorization = {'method': factorization, 'rank': rank, **params}
+        lap('factorization')
         
         # 4. Build content-based similarity
         print("  [4/4] Computing content similarity...")
-        embedding_matrix = np.vstack(packages_df['embedding_vector'].values)
-        content_similarity = cosine_similarity(embedding_matrix)
-        self.content_similarity_df = pd.DataFrame(
-            content_similarity,
-            index=packages_df['package_id'],
-            columns=packages_df['package_id']
+        self.content_ids = IdEncoder(packages_df['package_id'])
+        self.content_embeddings = normalize(np.asarray(embedding_matrix, dtype=np.float64))
+        self.n_neighbours = n_neighbours
+        self._align_ids()
+        self.package_features = self._package_features(packages_df, events_df)
+        self.label_vocabularies = {}
+        self.package_label_masks = label_masks(packages_df, 1, self.label_vocabularies)
+        self.user_label_masks = self._user_label_masks(users_df)
+        self.ranker = None
+        if ann_index is None:
+            ann_index = max(len(self.package_ids), len(self.content_ids)) >= ANN_MIN_VECTORS
+        self.factor_index = IVFIndex.build(self.package_factors) if ann_index else None
+        self.content_index = IVFIndex.build(self.content_embeddings) if ann_index else None
+        lap('ann_index')
+        self.neighbour_indices, self.neighbour_scores = build_content_neighbours(
+            self.content_embeddings, k=n_neighbours
         )
+        lap('content_neighbours')
+        self._record_shapes()
         
         print(f"✓ Model trained successfully!")
-        print(f"  - Users: {len(self.interaction_matrix)}")
+        print(f"  - Users: {len(self.user_ids)}")
         print(f"  - Packages: {len(packages_df)}")
         print(f"  - Interactions: {len(events_df)}")
+    
+    @_timed('update')
+    def update(self, events_df, packages_df=None, regularization=0.01, sweeps=1, package_embeddings=None):
+        """
+        Fold new events (and packages) into the model without a full retrain.
+        
+        New users and packages are appended to the id indexes and the new
+        events, weighted like the training events, are added to the
+        interaction matrix (with time decay, the stored weights are first
+        decayed to the newest event; type caps apply within the new batch).
+        Factors of new packages and of every user touched by the new events
+        are re-solved by ridge least squares against the other side's
+        factors (for SVD factors this is the same projection as
+        `svd.transform`; ALS models use the ALS solve with their training
+        alpha and regularization); existing package factors are kept fixed.
+        Call save_model() afterwards to publish the result as a new model
+        version.
+        
+        Parameters:
+        -----------
+        events_df : DataFrame with new user interaction events
+        packages_df : DataFrame with new packages (optional); rows whose
+            package_id is already in the catalogue are ignored
+        regularization : float
+            Ridge penalty for the least-squares solves (default: 0.01)
+        sweeps : int
+            Alternating package/user solve passes (default: 1)
+        package_embeddings : array or None
+            Embeddings of packages_df as one matrix in row order; default
+            parses its text_embedding column
+            
+        Returns:
+        --------
+        dict with counts of new users, new packages and updated users
+        """
+        # 1. Add new packages to the content model
+        new_catalogue = 0
+        if packages_df is not None and len(packages_df) > 0:
+            is_new = ((self.content_ids.encode(packages_df['package_id']) < 0)
+                      & ~packages_df['package_id'].duplicated().to_numpy())
+            new_packages = packages_df[is_new]
+            new_catalogue = len(new_packages)
+            if new_catalogue > 0:
+                self._add_catalogue_packages(
+                    new_packages, package_embeddings[is_new] if package_embeddings is not None else None
+                )
+        
+        # 2. Extend id indexes and add the new weights to the interaction matrix
+        events_df = events_df.dropna(subset=['user_id', 'package_id']).copy()
+        events_df['weight'] = self._event_type_weights(events_df)
+        n_old_packages = len(self.package_ids)
+        new_user_ids = self.user_ids.extend(events_df['user_id'])
+        new_package_ids = self.package_ids.extend(events_df['package_id'])
+        if self.user_label_masks is not None:
+            # Events carry no user profile; new users' labels are unknown until the next train
+            self.user_label_masks = np.vstack([
+                self.user_label_masks, np.full((len(new_user_ids), len(LABEL_FEATURES)), -1, dtype=np.int64)
+            ])
+        
+        old = self._decay_interactions(events_df)
+        new_interactions = weight_interactions(
+            events_df, self.event_weights, DEFAULT_EVENT_WEIGHT, user_ids=self.user_ids,
+            package_ids=self.package_ids, reference_time=self.interaction_reference_time,
+            **self.interaction_weighting
+        ).to_csr()
+        shape = new_interactions.shape
+        indptr = np.concatenate([old.indptr, np.full(len(new_user_ids), old.indptr[-1])])
+        self.interaction_matrix = sp.csr_matrix((old.data, old.indices, indptr), shape=shape) + new_interactions
+        self.interaction_matrix.eliminate_zeros()
+        self.interaction_matrix.sort_indices()
+        self._select_anchors()
+        
+        # 3. Fold the affected rows into the factor matrices
+        rank = self.user_factors.shape[1]
+        user_factors = np.vstack([self.user_factors, np.zeros((len(new_user_ids), rank))])
+        package_factors = np.vstack([self.package_factors, np.zeros((len(new_package_ids), rank))])
+        affected_users = np.flatnonzero(np.diff(new_interactions.indptr))
+        new_packages = np.arange(n_old_packages, len(self.package_ids))
+        for _ in range(sweeps):
+            if len(new_packages) > 0:
+                package_factors[new_packages] = self._fold_in(
+                    self.interaction_matrix[:, new_packages].T, user_factors, regularization
+                )
+            user_factors[affected_users] = self._fold_in(
+                self.interaction_matrix[affected_users], package_factors, regularization
+            )
+        self.user_factors = user_factors
+        self.package_factors = package_factors
+        if self.factor_index is not None and len(new_packages) > 0:
+            self.factor_index = self.factor_index.add(self.package_factors, n_old_packages)
+        self._align_ids()
+        
+        # 4. Add the new events to the cold-start popularity ranking
+        self._update_popularity(events_df)
         
-    def save_model(self):
-        """Save trained model to disk."""
-        model_path = self.model_dir / 'hybrid_model.pkl'
-        model_data = {
-            'svd': self.svd,
-            'interaction_matrix': self.interaction_matrix,
-            'predicted_scores_df': self.predicted_scores_df,
-            'content_similarity_df': self.content_similarity_df,
-            'packages_df': self.packages_df,
-            'event_weights': self.event_weights
+        print(f"✓ Model updated: {len(new_user_ids)} new users, {len(new_package_ids)} new packages, "
+              f"{len(affected_users)} users refreshed from {len(events_df)} events", file=sys.stderr)
+        self._record_shapes()
+        return {
+            'newUsers': len(new_user_ids),
+            'newPackages': len(new_package_ids),
+            'newCataloguePackages': new_catalogue,
+            'updatedUsers': len(affected_users)
         }
+    
+    def _fold_in(self, rows, fixed_factors, regularization):
+        """Solve factors for interaction rows against fixed factors, matching the training objective."""
+        if self.factorization.get('method') == 'als':
+            return als_solve(
+                als_confidence(rows, self.factorization.get('alpha', 40.0)), fixed_factors,
+                self.factorization.get('regularization', 0.1)
+            )
+        return _ridge_fold_in(rows, fixed_factors, regularization)
+    
+    def _add_catalogue_packages(self, new_packages, embeddings=None):
+        """Append packages to the content model and merge them into neighbour lists."""
+        n_old = len(self.content_ids)
+        if embeddings is None:
+            embeddings = _parse_embeddings(new_packages, dims=self.content_embeddings.shape[1])
+        embeddings = normalize(np.asarray(embeddings, dtype=np.float64))
+        self.content_ids.extend(new_packages['package_id'])
+        self.content_embeddings = np.vstack([self.content_embeddings, embeddings])
+        if self.package_features is not None:
+            self.package_features = np.vstack([self.package_features, package_feature_matrix(new_packages)])
+        if self.package_label_masks is not None:
+            self.package_label_masks = np.vstack([
+                self.package_label_masks, label_masks(new_packages, 1, self.label_vocabularies)
+            ])
+        self.package_lookup.update(_package_lookup(new_packages))
+        if self.content_index is not None:
+            self.content_index = self.content_index.add(self.content_embeddings, n_old)
+        if self.packages_df is not None:
+            self.packages_df = pd.concat([self.packages_df, new_packages], ignore_index=True)
         
-        with open(model_path, 'wb') as f:
-            pickle.dump(model_data, f)
+        k = min(self.n_neighbours, len(self.content_ids) - 1)
+        if k > self.neighbour_indices.shape[1]:
+            # Small catalogues keep fewer than n_neighbours; rebuild as it grows
+            self.neighbour_indices, self.neighbour_scores = build_content_neighbours(
+                self.content_embeddings, k=self.n_neighbours
+            )
+            return
         
-        print(f"✓ Model saved to {model_path}")
+        new_indices, new_scores = build_content_neighbours(
+            self.content_embeddings, k=k, first_row=n_old
+        )
+        old_indices, old_scores = merge_content_neighbours(
+            self.content_embeddings, self.neighbour_indices, self.neighbour_scores, first_new=n_old
+        )
+        self.neighbour_indices = np.vstack([old_indices, new_indices])
+        self.neighbour_scores = np.vstack([old_scores, new_scores])
+    
+    def _select_anchors(self):
+        """Store each user's n_anchors strongest interactions (ties: lowest package column)."""
+        self.user_anchors, self.user_anchor_weights = _row_top_k(self.interaction_matrix, self.n_anchors)
+    
+    def _content_profiles(self, rows):
+        """
+        Content query vector of each user row: the anchors' embeddings averaged
+        with the anchors' interaction weights. Anchors missing from the
+        catalogue are skipped. Returns (profiles, has_anchor).
+        """
+        content_rows = self.package_content_positions[self.user_anchors[rows]]
+        weights = np.where((self.user_anchors[rows] >= 0) & (content_rows >= 0),
+                           self.user_anchor_weights[rows], 0.0)
+        totals = weights.sum(axis=1)
+        has_anchor = totals > 0
+        weights[has_anchor] /= totals[has_anchor, None]
+        profiles = np.einsum('um,umd->ud', weights, self.content_embeddings[content_rows])
+        return profiles, has_anchor
+    
+    def _align_ids(self):
+        """Map interaction columns to content rows and back (-1 where a package is missing)."""
+        self.package_content_positions = self.content_ids.encode(self.package_ids.ids)
+        self.content_package_positions = self.package_ids.encode(self.content_ids.ids)
+    
+    def _package_features(self, packages_df, events_df):
+        """Catalogue features of each content row, with each package's events in the last 7 days."""
+        recent = None
+        if 'timestamp' in events_df.columns:
+            counts = recent_event_counts(
+                self.package_ids.encode(events_df['package_id']), _parse_timestamps(events_df['timestamp']),
+                len(self.package_ids), counts=events_df['count'] if 'count' in events_df.columns else None
+            )
+            if counts is not None:
+                positions = self.content_package_positions
+                recent = np.where(positions >= 0, counts[positions], 0.0)
+        return package_feature_matrix(packages_df, recent)
+    
+    def _user_label_masks(self, users_df):
+        """Label masks of each user row from users_df (-1 for users it does not describe)."""
+        masks = np.full((len(self.user_ids), len(LABEL_FEATURES)), -1, dtype=np.int64)
+        if 'user_id' not in users_df.columns:
+            return masks
+        positions = self.user_ids.encode(users_df['user_id'])
+        known = positions >= 0
+        masks[positions[known]] = label_masks(users_df[known], 0, self.label_vocabularies)
+        return masks
+    
+    def _event_type_weights(self, events_df):
+        """Map each event's type to its interaction weight (times its count for aggregated rows)."""
+        weights, _ = event_type_weights(events_df['event_type'], self.event_weights, DEFAULT_EVENT_WEIGHT,
+                                        events_df['count'] if 'count' in events_df.columns else None)
+        return pd.Series(weights, index=events_df.index)
+    
+    def _decay_interactions(self, events_df):
+        """
+        Interaction matrix decayed to the newest of events_df, if time decay is on.
+        
+        Moves interaction_reference_time forward; stored weights are
+        multiplied by the decay for the elapsed time.
+        """
+        half_life_days = self.interaction_weighting.get('half_life_days')
+        if not half_life_days or 'timestamp' not in events_df.columns:
+            return self.interaction_matrix
+        newest = _parse_timestamps(events_df['timestamp']).max()
+        reference = self.interaction_reference_time
+        if pd.isna(newest) or (reference is not None and newest <= reference):
+            return self.interaction_matrix
+        self.interaction_reference_time = newest
+        if reference is None:
+            return self.interaction_matrix
+        elapsed_days = (newest - reference).total_seconds() / 86400
+        return self.interaction_matrix * np.power(0.5, elapsed_days / half_life_days)
+        
+    def save_model(self, keep_versions=3):
+        """
+        Save trained model to disk as a new published version.
+        
+        The model is written as a directory of .npy arrays with a JSON
+        manifest (see model_store.py) and then published atomically, so a
+        running `serve` process never reloads a half-written model.
+        """
+        catalogue_ids = list(self.package_lookup)
+        subjects = list(self.popular_by_subject)
+        subject_ranks = [self.popular_by_subject[subject] for subject in subjects]
         
-    def load_model(self):
-        """Load trained model from disk."""
-        model_path = self.model_dir / 'hybrid_model.pkl'
+        arrays = {
+            'user_ids': self.user_ids.to_array(),
+            'package_ids': self.package_ids.to_array(),
+            'user_factors': self.user_factors,
+            'package_factors': self.package_factors,
+            'interactions_indptr': self.interaction_matrix.indptr,
+            'interactions_indices': self.interaction_matrix.indices,
+            'interactions_data': self.interaction_matrix.data,
+            'user_anchors': self.user_anchors,
+            'user_anchor_weights': self.user_anchor_weights,
+            'content_ids': self.content_ids.to_array(),
+            'content_embeddings': self.content_embeddings,
+            'neighbour_indices': self.neighbour_indices,
+            'neighbour_scores': self.neighbour_scores,
+            'popular_indices': self.popular_indices,
+            'popular_scores': self.popular_scores,
+            'popular_subjects': _string_array(subjects),
+            'popular_subject_offsets': np.cumsum([0] + [len(r) for r in subject_ranks]),
+            'popular_subject_ranks': (np.concatenate(subject_ranks) if subject_ranks
+                                      else np.empty(0, dtype=np.int32)),
+            'catalogue_ids': _string_array(catalogue_ids),
+            'catalogue_titles': _string_array(self.package_lookup[p]['title'] for p in catalogue_ids),
+            'catalogue_subjects': _string_array(self.package_lookup[p]['subject'] for p in catalogue_ids),
+        }
+        if self.factor_index is not None:
+            arrays.update(self.factor_index.arrays('factor_ivf'))
+        if self.content_index is not None:
+            arrays.update(self.content_index.arrays('content_ivf'))
+        if self.package_features is not None:
+            arrays['package_features'] = self.package_features
+        if self.user_label_masks is not None:
+            arrays['user_label_masks'] = self.user_label_masks
+            arrays['package_label_masks'] = self.package_label_masks
+        if self.ranker is not None:
+            arrays.update(self.ranker.arrays('ranker'))
+        manifest = {
+            'model': 'hybrid',
+            'event_weights': self.event_weights,
+            'factorization': self.factorization,
+            'ann_probes': self.ann_probes,
+            'ann_candidates': self.ann_candidates,
+            'ranker_candidates': self.ranker_candidates,
+            'label_vocabularies': self.label_vocabularies,
+            'n_users': len(self.user_ids),
+            'n_packages': len(self.package_ids),
+            'n_catalogue': len(self.content_ids),
+            'n_neighbours': self.n_neighbours,
+            'n_anchors': self.n_anchors,
+            'popularity_half_life_days': self.popularity_half_life_days,
+            'popularity_reference_time': (self.popularity_reference_time.isoformat()
+                                          if pd.notna(self.popularity_reference_time) else None),
+            'interaction_weighting': self.interaction_weighting,
+            'interaction_reference_time': (self.interaction_reference_time.isoformat()
+                                           if self.interaction_reference_time is not None else None)
+        }
+        
+        version = model_store.write_version(self.model_path, arrays, manifest)
+        model_store.publish(self.model_path, version, keep=keep_versions)
+        self.model_version = version
+        
+        print(f"✓ Model saved to {self.model_path / version}", file=sys.stderr)
+        
+    def load_model(self, mmap=True):
+        """
+        Load the published model version from disk.
+        
+        Arrays are memory-mapped read-only by default, so several worker
+        processes share the same pages. Falls back to the legacy
+        hybrid_model.pkl if no version has been published yet.
+        """
+        started = time.perf_counter()
+        if model_store.current_version(self.model_path) is None:
+            if self.legacy_model_path.exists():
+                print(f"⚠ Loading legacy pickle {self.legacy_model_path}; "
+                      f"run `python hybrid_recommender.py convert` to upgrade it", file=sys.stderr)
+                self._load_pickle(self.legacy_model_path)
+                self._record_load(started, 'pickle')
+                return
+            raise FileNotFoundError(f"Model not found at {self.model_path}. Train the model first.")
         
-        if not model_path.exists():
-            raise FileNotFoundError(f"Model not found at {model_path}. Train the model first.")
+        manifest, arrays = model_store.read_version(self.model_path, mmap=mmap)
         
+        self.user_ids = IdEncoder(arrays['user_ids'])
+        self.package_ids = IdEncoder(arrays['package_ids'])
+        self.user_factors = arrays['user_factors']
+        self.package_factors = arrays['package_factors']
+        self.interaction_matrix = sp.csr_matrix(
+            (arrays['interactions_data'], arrays['interactions_indices'], arrays['interactions_indptr']),
+            shape=(len(self.user_ids), len(self.package_ids))
+        )
+        # Versions saved before anchors were stored derive them from the matrix
+        self.n_anchors = manifest.get('n_anchors', 1)
+        if 'user_anchor_weights' in arrays:
+            self.user_anchors = arrays['user_anchors']
+            self.user_anchor_weights = arrays['user_anchor_weights']
+        else:
+            self._select_anchors()
+        self.content_ids = IdEncoder(arrays['content_ids'])
+        self.content_embeddings = arrays['content_embeddings']
+        self.neighbour_indices = arrays['neighbour_indices']
+        self.neighbour_scores = arrays['neighbour_scores']
+        self.popular_indices = arrays['popular_indices']
+        self.popular_scores = arrays['popular_scores']
+        
+        offsets = arrays['popular_subject_offsets']
+        self.popular_by_subject = {
+            str(subject): arrays['popular_subject_ranks'][offsets[i]:offsets[i + 1]]
+            for i, subject in enumerate(arrays['popular_subjects'])
+        }
+        self.package_lookup = {
+            str(package_id): {'title': str(title), 'subject': str(subject)}
+            for package_id, title, subject in zip(
+                arrays['catalogue_ids'], arrays['catalogue_titles'], arrays['catalogue_subjects']
+            )
+        }
+        self.packages_df = None
+        self.event_weights = manifest['event_weights']
+        # Versions saved before factorization backends existed are SVD models
+        self.factorization = manifest.get('factorization', {'method': 'svd'})
+        self.factor_index = IVFIndex.from_arrays(arrays, 'factor_ivf')
+        self.content_index = IVFIndex.from_arrays(arrays, 'content_ivf')
+        self.ann_probes = manifest.get('ann_probes', 8)
+        self.ann_candidates = manifest.get('ann_candidates', 200)
+        # Versions saved before the re-ranking stage have none of these
+        self.package_features = arrays.get('package_features')
+        self.user_label_masks = arrays.get('user_label_masks')
+        self.package_label_masks = arrays.get('package_label_masks')
+        self.label_vocabularies = manifest.get('label_vocabularies', {})
+        self.ranker = LinearRanker.from_arrays(arrays, 'ranker')
+        if self.ranker is not None and self.ranker.features != RANKING_FEATURES:
+            print(f"⚠ Ignoring ranker with features {self.ranker.features}", file=sys.stderr)
+            self.ranker = None
+        self.ranker_candidates = manifest.get('ranker_candidates', 50)
+        self._align_ids()
+        self.n_neighbours = manifest['n_neighbours']
+        self.popularity_half_life_days = manifest['popularity_half_life_days']
+        self.popularity_reference_time = (pd.Timestamp(manifest['popularity_reference_time'])
+                                          if manifest['popularity_reference_time'] else None)
+        # Versions saved before interaction weighting existed used plain type weights
+        self.interaction_weighting = manifest.get('interaction_weighting', {})
+        reference = manifest.get('interaction_reference_time')
+        self.interaction_reference_time = pd.Timestamp(reference) if reference else None
+        self.model_version = manifest['version']
+        self._record_load(started, 'npy')
+        
+        # stdout carries the JSON protocol for the Node.js API, so log to stderr
+        print(f"✓ Model loaded from {self.model_path / self.model_version}", file=sys.stderr)
+    
+    def _load_pickle(self, model_path):
+        """
+        Load a hybrid_model.pkl written by the original pickle-based save_model.
+        
+        Those files stored dense users x packages frames and an N x N content
+        similarity matrix; only the factors and neighbour table are kept.
+        """
         with open(model_path, 'rb') as f:
             model_data = pickle.load(f)
         
-        self.svd = model_data['svd']
-        self.interaction_matrix = model_data['interaction_matrix']
-        self.predicted_scores_df = model_data['predicted_scores_df']
-        self.content_similarity_df = model_data['content_similarity_df']
+        dense_interactions = model_data['interaction_matrix']
+        self.interaction_matrix = sp.csr_matrix(dense_interactions.to_numpy())
+        self.n_anchors = 1
+        self._select_anchors()
+        self.user_ids = IdEncoder(dense_interactions.index)
+        self.package_ids = IdEncoder(dense_interactions.columns)
+        self.user_factors = model_data['svd'].transform(dense_interactions)
+        self.package_factors = model_data['svd'].components_.T
+        self.factorization = {'method': 'svd', 'rank': self.package_factors.shape[1]}
+        
+        # Recover embeddings whose dot products reproduce the stored cosine matrix
+        similarity = model_data['content_similarity_df']
+        eigenvalues, eigenvectors = np.linalg.eigh(similarity.to_numpy())
+        keep = eigenvalues > 1e-9 * eigenvalues.max()
+        self.content_ids = IdEncoder(similarity.index)
+        self.content_embeddings = normalize(eigenvectors[:, keep] * np.sqrt(eigenvalues[keep]))
+        self.neighbour_indices, self.neighbour_scores = build_content_neighbours(
+            self.content_embeddings
+        )
+        
         self.packages_df = model_data['packages_df']
         self.event_weights = model_data['event_weights']
+        self.interaction_weighting = {}
+        self.interaction_reference_time = None
+        self.package_lookup = _package_lookup(self.packages_df)
+        self._build_popularity()
+        self.factor_index = None
+        self.content_index = None
+        self._align_ids()
         
-        print(f"✓ Model loaded from {model_path}")
-        
-    def recommend(self, user_id, n=5, collaborative_weight=0.6, content_weight=0.4):
+        self.model_version = f'legacy-{int(model_path.stat().st_mtime)}'
+        print(f"✓ Model loaded from {model_path}", file=sys.stderr)
+    
+    def _record_load(self, started, model_format):
+        """Record load time and the loaded matrix shapes."""
+        self.metrics.observe('load_seconds', time.perf_counter() - started, format=model_format)
+        self.metrics.increment('model_loads_total', format=model_format)
+        self._record_shapes()
+    
+    def _record_shapes(self):
+        """Publish the current model's matrix shapes as gauges."""
+        for name in ('interaction_matrix', 'user_factors', 'package_factors',
+                     'content_embeddings', 'neighbour_indices'):
+            self.metrics.record_shape(name, getattr(self, name))
+    
+    def published_version(self):
+        """Version load_model would load right now, without loading it."""
+        version = model_store.current_version(self.model_path)
+        if version is None and self.legacy_model_path.exists():
+            return f'legacy-{int(self.legacy_model_path.stat().st_mtime)}'
+        return version
+    
+    def convert_legacy_model(self):
+        """Convert hybrid_model.pkl into a published model version."""
+        if not self.legacy_model_path.exists():
+            raise FileNotFoundError(f"No legacy model at {self.legacy_model_path}")
+        self._load_pickle(self.legacy_model_path)
+        self.save_model()
+        return self.model_version
+    
+    @_timed('recommend')
+    def recommend(self, user_id, n=5, collaborative_weight=0.6, content_weight=0.4, rerank=True):
         """
         Get hybrid recommendations for a user.
         
@@ -156,76 +709,415 @@ class HybridRecommender:
             Weight for collaborative filtering (default: 0.6)
         content_weight : float
             Weight for content-based filtering (default: 0.4)
+        rerank : bool
+            Re-order the candidates with the model's ranker, if it has one
             
         Returns:
         --------
         list of dict with package recommendations
         """
+        rerank = rerank and self.ranker is not None
+        
         # Check if user exists
-        if user_id not in self.predicted_scores_df.index:
+        user_position = self.user_ids.code(user_id)
+        if user_position < 0:
             # New user - use popularity-based recommendations
+            self.metrics.increment('fallback_total', reason='cold_start')
             return self._get_popular_packages(n)
         
-        # Get collaborative scores
-        user_predictions = self.predicted_scores_df.loc[user_id]
+        if self.factor_index is not None:
+            # Large catalogue - score index candidates only
+            recommendations = self._recommend_indexed(user_position, n, collaborative_weight, content_weight,
+                                                      rerank)
+            if recommendations is not None:
+                return recommendations
+        
+        return self._recommend_block([user_position], n, collaborative_weight, content_weight, rerank)[0]
+    
+    def _recommend_indexed(self, user_position, n, collaborative_weight, content_weight, rerank=False):
+        """
+        Hybrid recommendations for a known user from IVF index candidates.
+        
+        Candidates are the best packages by collaborative score and by
+        similarity to the user's anchor profile, retrieved from the
+        indexes and re-scored exactly. The min/max used to normalise each
+        score come from searching the indexes with the query and its
+        negation, so no request touches the whole catalogue. With rerank the
+        most popular packages join the candidates and the ranker orders
+        them. Returns None if fewer than n candidates survive filtering (the
+        caller then scores every package).
+        """
+        interactions = self.interaction_matrix
+        interacted = interactions.indices[interactions.indptr[user_position]:interactions.indptr[user_position + 1]]
+        k = max(self.ann_candidates, n) + len(interacted)
         
-        # Get packages user already interacted with
-        interacted_packages = self.interaction_matrix.loc[user_id]
-        already_interacted = interacted_packages[interacted_packages > 0].index.tolist()
+        user_vector = self.user_factors[user_position]
+        collab_candidates, collab_top = self.factor_index.search(
+            self.package_factors, user_vector, k, self.ann_probes
+        )
+        collab_bottom = -self.factor_index.search(self.package_factors, -user_vector, 1, self.ann_probes)[1]
+        collab_range = (collab_bottom[0], collab_top[0])
         
-        # Get content-based scores
-        if len(already_interacted) > 0:
-            last_package_id = interacted_packages[interacted_packages > 0].idxmax()
-            if last_package_id in self.content_similarity_df.index:
-                content_scores = self.content_similarity_df[last_package_id]
+        candidates = collab_candidates
+        has_anchor = False
+        has_history = len(interacted) > 0
+        if has_history:
+            # Same query as the exact path: the user's anchor profile
+            profiles, has_anchors = self._content_profiles([user_position])
+            has_anchor = has_anchors[0]
+            if has_anchor:
+                anchor_vector = profiles[0]
+                content_candidates, content_top = self.content_index.search(
+                    self.content_embeddings, anchor_vector, k, self.ann_probes
+                )
+                content_bottom = -self.content_index.search(
+                    self.content_embeddings, -anchor_vector, 1, self.ann_probes
+                )[1]
+                content_range = (content_bottom[0], content_top[0])
+                content_packages = self.content_package_positions[content_candidates]
+                candidates = np.union1d(candidates, content_packages[content_packages >= 0])
             else:
-                content_scores = pd.Series(0, index=self.content_similarity_df.index)
-        else:
-            content_scores = pd.Series(0, index=user_predictions.index)
-            content_weight = 0
-            collaborative_weight = 1.0
-        
-        # Normalize scores
-        collab_min, collab_max = user_predictions.min(), user_predictions.max()
-        if collab_max > collab_min:
-            collab_normalized = (user_predictions - collab_min) / (collab_max - collab_min)
+                self.metrics.increment('fallback_total', reason='anchor_not_in_catalogue')
         else:
-            collab_normalized = user_predictions
+            self.metrics.increment('fallback_total', reason='no_history')
+            collaborative_weight, content_weight = 1.0, 0.0
+        if rerank:
+            popular_candidates = self.popular_indices[:self.ranker_candidates + len(interacted)]
+            candidates = np.union1d(candidates, popular_candidates)
         
-        content_min, content_max = content_scores.min(), content_scores.max()
-        if content_max > content_min:
-            content_normalized = (content_scores - content_min) / (content_max - content_min)
-        else:
-            content_normalized = content_scores
+        # Only packages present in both models, minus the ones already seen
+        candidates = candidates[~np.isin(candidates, interacted)]
+        content_positions = self.package_content_positions[candidates]
+        if has_history:
+            candidates = candidates[content_positions >= 0]
+            content_positions = content_positions[content_positions >= 0]
+        if len(candidates) < n:
+            return None
+        
+        collab = _minmax_scale(self.package_factors[candidates] @ user_vector, *collab_range)
+        content = np.zeros(len(candidates))
+        if has_anchor:
+            content = _minmax_scale(self.content_embeddings[content_positions] @ anchor_vector, *content_range)
+        hybrid = collaborative_weight * collab + content_weight * content
+        
+        if rerank:
+            # Origins: the first ranker_candidates recommendable packages of each list
+            def first(ranked):
+                return ranked[np.isin(ranked, candidates)][:self.ranker_candidates]
+            origin_lists = [collab_candidates, content_packages if has_anchor else candidates[:0],
+                            popular_candidates]
+            origin_flags = np.column_stack([np.isin(candidates, first(ranked)) for ranked in origin_lists])
+            features = self._ranking_features(np.full(len(candidates), user_position), candidates,
+                                              hybrid, collab, content, origin_flags)
+            return self._ranked_results(np.zeros(len(candidates), dtype=np.intp), candidates, hybrid,
+                                        self.ranker.score(features), 1, n)[0]
+        
+        top = np.argsort(-hybrid, kind='stable')[:n]
+        return self._format_results(zip(self.package_ids.decode(candidates[top]), hybrid[top]), 'score', 'hybrid')
+    
+    @_timed('recommend_batch')
+    def recommend_batch(self, user_ids, n=5, collaborative_weight=0.6, content_weight=0.4,
+                        batch_size=1024, rerank=True):
+        """
+        Get hybrid recommendations for many users at once.
+        
+        Scores a block of users per step with NumPy matrix operations instead
+        of one pandas Series per user. Produces the same ranking as calling
+        `recommend` for each user: models with IVF indexes (catalogues of
+        ann_index.ANN_MIN_VECTORS packages or more, where per-user index
+        queries beat dense blocks) answer each user from index candidates,
+        as `recommend` does.
+        
+        Parameters:
+        -----------
+        user_ids : iterable of str
+            User IDs to get recommendations for
+        n : int
+            Number of recommendations per user
+        collaborative_weight : float
+            Weight for collaborative filtering (default: 0.6)
+        content_weight : float
+            Weight for content-based filtering (default: 0.4)
+        batch_size : int
+            Number of users scored per matrix block
+        rerank : bool
+            Re-order the candidates with the model's ranker, if it has one;
+            the features of a block's candidates are scored as one matrix
+            
+        Returns:
+        --------
+        dict mapping user_id to a list of package recommendations
+        """
+        rerank = rerank and self.ranker is not None
+        user_ids = list(dict.fromkeys(user_ids))
+        positions = self.user_ids.encode(user_ids)
+        known = positions >= 0
+        
+        results = {}
+        if not known.all():
+            # New users - share one popularity-based list
+            self.metrics.increment('fallback_total', int((~known).sum()), reason='cold_start')
+            popular = self._get_popular_packages(n)
+            for user_id in user_ids:
+                results[user_id] = popular
+        
+        known_users = [user_id for user_id, is_known in zip(user_ids, known) if is_known]
+        known_positions = positions[known]
+        if self.factor_index is not None:
+            # Large catalogue - index candidates per user beat dense blocks and match recommend
+            for user_id in known_users:
+                results[user_id] = self.recommend(
+                    user_id, n=n, collaborative_weight=collaborative_weight, content_weight=content_weight,
+                    rerank=rerank
+                )
+            known_users = []
+        
+        for start in range(0, len(known_users), batch_size):
+            block_results = self._recommend_block(
+                known_positions[start:start + batch_size], n, collaborative_weight, content_weight, rerank
+            )
+            results.update(zip(known_users[start:start + batch_size], block_results))
         
-        # Combine scores
-        common_packages = collab_normalized.index.intersection(content_normalized.index)
-        hybrid_scores = (
-            collaborative_weight * collab_normalized[common_packages] +
-            content_weight * content_normalized[common_packages]
+        return {user_id: results[user_id] for user_id in user_ids}
+    
+    def _recommend_block(self, rows, n, collaborative_weight, content_weight, rerank=False):
+        """Score a block of known user rows as dense matrices; one result list per row."""
+        rows = np.asarray(rows)
+        collab, content, hybrid, has_history, has_anchor = self._score_block(
+            rows, collaborative_weight, content_weight
         )
+        if not has_history.all():
+            self.metrics.increment('fallback_total', int((~has_history).sum()), reason='no_history')
+        if not has_anchor[has_history].all():
+            self.metrics.increment('fallback_total', int((has_history & ~has_anchor).sum()),
+                                   reason='anchor_not_in_catalogue')
+        
+        hybrid[~self._recommendable(rows, has_history)] = -np.inf
         
-        # Filter out already interacted packages
-        uninteracted_scores = hybrid_scores[~hybrid_scores.index.isin(already_interacted)]
+        if rerank:
+            return self._rerank_block(rows, collab, content, hybrid, has_anchor, n)
         
-        # Get top N recommendations
-        top_recommendations = uninteracted_scores.sort_values(ascending=False).head(n)
+        top, top_scores = _top_k_rows(hybrid, n)
         
-        # Format results
         results = []
-        for package_id, score in top_recommendations.items():
-            package_info = self.packages_df[self.packages_df['package_id'] == package_id]
-            if not package_info.empty:
+        for columns, scores in zip(top, top_scores):
+            valid = np.isfinite(scores)
+            results.append(self._format_results(
+                zip(self.package_ids.decode(columns[valid]), scores[valid]), 'score', 'hybrid'
+            ))
+        return results
+    
+    def _recommendable(self, rows, has_history):
+        """
+        Mask (rows x packages) of what each user row may be recommended:
+        packages present in both models, minus the ones already seen. Rows
+        without history may also get packages missing from the catalogue.
+        """
+        interactions = self.interaction_matrix[rows]
+        recommendable = np.ones((len(rows), len(self.package_ids)), dtype=bool)
+        recommendable[has_history[:, None] & (self.package_content_positions < 0)[None, :]] = False
+        recommendable[np.repeat(np.arange(len(rows)), np.diff(interactions.indptr)), interactions.indices] = False
+        return recommendable
+    
+    def _score_block(self, rows, collaborative_weight, content_weight):
+        """
+        Dense first-stage scores of a block of known user rows, in package column order.
+        
+        Returns (collab, content, hybrid, has_history, has_anchor): the
+        per-row min-max normalised collaborative and content scores and
+        their blend. Rows without history get collaborative scores only.
+        """
+        collab = self._user_scores(rows)
+        has_history = np.diff(self.interaction_matrix.indptr)[rows] > 0
+        
+        # Content scores against each user's anchor profile
+        profiles, has_anchor = self._content_profiles(rows)
+        content = np.zeros((len(rows), len(self.content_ids)))
+        content[has_anchor] = profiles[has_anchor] @ self.content_embeddings.T
+        
+        collab = _minmax_rows(collab)
+        content = _minmax_rows(content)
+        
+        # Align content columns to the collaborative package order
+        content_columns = self.package_content_positions
+        aligned_content = np.zeros_like(collab)
+        in_content = content_columns >= 0
+        aligned_content[:, in_content] = content[:, content_columns[in_content]]
+        
+        collab_weights = np.where(has_history, collaborative_weight, 1.0)[:, None]
+        content_weights = np.where(has_history, content_weight, 0.0)[:, None]
+        hybrid = collab_weights * collab + content_weights * aligned_content
+        return collab, aligned_content, hybrid, has_history, has_anchor
+    
+    def _candidate_origins(self, collab, content, recommendable, has_anchor, k):
+        """
+        Re-ranking candidates of a block: each row's k best recommendable
+        packages by collaborative score, by content score and by popularity.
+        
+        Returns (keys, origin_flags): the sorted row * packages + column key
+        of each candidate and its ORIGIN_FEATURES flags.
+        """
+        origin_lists = [
+            np.where(recommendable, collab, -np.inf),
+            np.where(recommendable & has_anchor[:, None], content, -np.inf),
+            np.where(recommendable, self._popularity_scores()[None, :], -np.inf),
+        ]
+        n_columns = collab.shape[1]
+        keys, origins = [], []
+        for origin, scores in enumerate(origin_lists):
+            top, top_scores = _top_k_rows(scores, k)
+            found = np.isfinite(top_scores)
+            keys.append((np.arange(len(collab))[:, None] * n_columns + top)[found])
+            origins.append(np.full(found.sum(), origin))
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        origin_flags = np.zeros((len(keys), len(ORIGIN_FEATURES)))
+        origin_flags[inverse, np.concatenate(origins)] = 1.0
+        return keys, origin_flags
+    
+    def _rerank_block(self, rows, collab, content, hybrid, has_anchor, n):
+        """
+        Order each row's candidates by ranker score; one result list per row.
+        
+        The features of every candidate in the block form one matrix,
+        scored in a single call.
+        """
+        keys, origin_flags = self._candidate_origins(
+            collab, content, np.isfinite(hybrid), has_anchor, max(self.ranker_candidates, n)
+        )
+        block_rows, columns = np.divmod(keys, hybrid.shape[1])
+        candidate_hybrid = hybrid[block_rows, columns]
+        features = self._ranking_features(rows[block_rows], columns, candidate_hybrid,
+                                          collab[block_rows, columns], content[block_rows, columns], origin_flags)
+        return self._ranked_results(block_rows, columns, candidate_hybrid, self.ranker.score(features),
+                                    len(hybrid), n)
+    
+    def _ranking_features(self, user_rows, columns, hybrid, collab, content, origin_flags):
+        """One feature row (reranker.RANKING_FEATURES order) per (user row, package column) candidate."""
+        content_rows = self.package_content_positions[columns]
+        known = content_rows >= 0
+        label_features = np.full((len(columns), len(LABEL_FEATURES)), np.nan)
+        if self.user_label_masks is not None:
+            label_features[known] = label_overlap_features(
+                self.user_label_masks[user_rows[known]], self.package_label_masks[content_rows[known]]
+            )
+        package_features = np.full((len(columns), len(PACKAGE_FEATURES)), np.nan)
+        if self.package_features is not None:
+            package_features[known] = self.package_features[content_rows[known]]
+        return np.column_stack([hybrid, collab, content, origin_flags, label_features, package_features])
+    
+    def _ranked_results(self, rows, columns, scores, ranker_scores, n_rows, n):
+        """
+        Top n candidates of each of n_rows rows by ranker score, formatted;
+        ties keep column order. `score` stays the hybrid score and the
+        ranker's output is added as `rankerScore`.
+        """
+        order = np.lexsort((columns, -ranker_scores, rows))
+        rows, columns, scores, ranker_scores = rows[order], columns[order], scores[order], ranker_scores[order]
+        starts = np.searchsorted(rows, np.arange(n_rows))
+        ends = np.minimum(np.searchsorted(rows, np.arange(n_rows), side='right'), starts + n)
+        return [
+            self._format_results(
+                zip(self.package_ids.decode(columns[start:end]), scores[start:end], ranker_scores[start:end]),
+                'score', 'hybrid', extra_keys=('rankerScore',)
+            )
+            for start, end in zip(starts, ends)
+        ]
+    
+    def fit_ranker(self, examples_df, regularization=1.0, collaborative_weight=0.6, content_weight=0.4,
+                   batch_size=1024):
+        """
+        Fit the second-stage ranker from labelled (user, package) examples.
+        
+        Features of each example are recomputed by this model as recommend
+        computes them, origin flags included: whether the package is among
+        the user's ranker_candidates best recommendable packages by
+        collaborative score, content score and popularity. Examples with a
+        user or package the model does not know are skipped.
+        
+        Parameters:
+        -----------
+        examples_df : DataFrame with user_id, package_id and label
+            (see ranking_examples.csv)
+        regularization : float
+            Ridge penalty of the linear model (default: 1.0)
+        collaborative_weight, content_weight : float
+            Blend of the hybrid_score feature, as passed to recommend
+        batch_size : int
+            Example users scored per matrix block
+            
+        Returns:
+        --------
+        dict with the number of examples used and skipped
+        """
+        rows = self.user_ids.encode(examples_df['user_id'])
+        columns = self.package_ids.encode(examples_df['package_id'])
+        known = (rows >= 0) & (columns >= 0)
+        rows, columns = rows[known], columns[known]
+        labels = examples_df['label'].to_numpy(dtype=np.float64)[known]
+        
+        features = np.empty((len(rows), len(RANKING_FEATURES)))
+        users, user_index = np.unique(rows, return_inverse=True)
+        for start in range(0, len(users), batch_size):
+            block_users = users[start:start + batch_size]
+            in_block = (user_index >= start) & (user_index < start + batch_size)
+            collab, content, hybrid, has_history, has_anchor = self._score_block(
+                block_users, collaborative_weight, content_weight
+            )
+            block_rows, block_columns = user_index[in_block] - start, columns[in_block]
+            
+            # Look each example up among the block's candidates; others have no origin
+            keys, candidate_flags = self._candidate_origins(
+                collab, content, self._recommendable(block_users, has_history), has_anchor,
+                self.ranker_candidates
+            )
+            example_keys = block_rows * hybrid.shape[1] + block_columns
+            positions = np.searchsorted(keys, example_keys)
+            found = positions < len(keys)
+            found[found] = keys[positions[found]] == example_keys[found]
+            origin_flags = np.zeros((len(example_keys), len(ORIGIN_FEATURES)))
+            origin_flags[found] = candidate_flags[positions[found]]
+            
+            features[in_block] = self._ranking_features(
+                rows[in_block], block_columns, hybrid[block_rows, block_columns],
+                collab[block_rows, block_columns], content[block_rows, block_columns], origin_flags
+            )
+        
+        self.ranker = LinearRanker.fit(features, labels, regularization=regularization)
+        print(f"✓ Ranker fitted on {len(rows)} examples ({int((~known).sum())} skipped)")
+        return {'examples': len(rows), 'skipped': int((~known).sum())}
+    
+    def _user_scores(self, user_positions):
+        """Collaborative scores for the given user rows (users x packages)."""
+        return self.user_factors[user_positions] @ self.package_factors.T
+    
+    def _format_results(self, scored_packages, score_key, recommendation_type, extra_keys=()):
+        """
+        Format (package_id, score, *extra) tuples as result dicts.
+        
+        Extra values are added as floats under extra_keys. Packages missing
+        from the catalogue are skipped. Each row is a dict lookup, so
+        formatting costs O(results) rather than a catalogue scan.
+        """
+        results = []
+        missing = 0
+        for package_id, score, *extra in scored_packages:
+            package_info = self.package_lookup.get(package_id)
+            if package_info is not None:
                 results.append({
                     'packageId': str(package_id),
-                    'score': float(score),
-                    'title': package_info.iloc[0].get('title', ''),
-                    'subject': package_info.iloc[0].get('subject', ''),
-                    'recommendationType': 'hybrid'
+                    score_key: float(score),
+                    **{key: float(value) for key, value in zip(extra_keys, extra)},
+                    'title': package_info['title'],
+                    'subject': package_info['subject'],
+                    'recommendationType': recommendation_type
                 })
-        
+            else:
+                missing += 1
+        if missing:
+            self.metrics.increment('fallback_total', missing, reason='missing_catalogue_entry')
         return results
     
+    @_timed('similar')
     def get_similar_packages(self, package_id, n=5):
         """
         Get similar packages based on content similarity.
@@ -235,53 +1127,614 @@ class HybridRecommender:
         package_id : str
             Package ID to find similar packages for
         n : int
-            Number of similar packages to return
+            Number of similar packages to return (at most the number of
+            neighbours kept at training time)
             
         Returns:
         --------
         list of dict with similar packages
         """
-        if package_id not in self.content_similarity_df.index:
+        position = self.content_ids.code(package_id)
+        if position < 0:
+            self.metrics.increment('fallback_total', reason='missing_package')
             return []
         
-        similarities = self.content_similarity_df[package_id].sort_values(ascending=False)
-        similar_packages = similarities[similarities.index != package_id].head(n)
+        # Precomputed neighbours are already sorted by similarity
+        similar_packages = zip(
+            self.content_ids.decode(self.neighbour_indices[position, :n]),
+            self.neighbour_scores[position, :n]
+        )
         
-        results = []
-        for pkg_id, similarity in similar_packages.items():
-            package_info = self.packages_df[self.packages_df['package_id'] == pkg_id]
-            if not package_info.empty:
-                results.append({
-                    'packageId': str(pkg_id),
-                    'similarity': float(similarity),
-                    'title': package_info.iloc[0].get('title', ''),
-                    'subject': package_info.iloc[0].get('subject', ''),
-                    'recommendationType': 'content-based'
-                })
+        return self._format_results(similar_packages, 'similarity', 'content-based')
+    
+    def precompute_lists(self, n=5, max_similar=20000):
+        """
+        Build the popular lists (global and per subject) and, for catalogues
+        of at most max_similar packages, every package's similar list.
         
-        return results
+        Returns {'popular': {subject or None: results},
+                 'similar': {package_id: results}}, each list identical to
+        what `_get_popular_packages(n, subject)` and
+        `get_similar_packages(package_id, n)` return.
+        """
+        popular = {None: []}
+        if self.popular_indices is not None and self.interaction_matrix.shape[0] > 0:
+            popular[None] = self._popular_results(slice(0, n))
+            for subject, ranks in self.popular_by_subject.items():
+                popular[subject] = self._popular_results(ranks[:n])
+        
+        similar = {}
+        if self.neighbour_indices is not None and len(self.content_ids) <= max_similar:
+            neighbour_ids = self.content_ids.decode(self.neighbour_indices[:, :n])
+            for package_id, ids, scores in zip(self.content_ids.ids, neighbour_ids, self.neighbour_scores[:, :n]):
+                similar[package_id] = self._format_results(zip(ids, scores), 'similarity', 'content-based')
+        return {'popular': popular, 'similar': similar}
+    
+    def _build_popularity(self, events_df=None, half_life_days=None):
+        """
+        Rank packages by total interaction weight, once, for cold-start users.
+        
+        With half_life_days and a timestamp column, each event's weight is
+        decayed by its age relative to the newest event. Subject buckets
+        keep the global order restricted to one subject.
+        """
+        self.popularity_half_life_days = half_life_days
+        self.popularity_reference_time = None
+        if half_life_days and events_df is not None and 'timestamp' in events_df.columns:
+            timestamps = _parse_timestamps(events_df['timestamp'])
+            self.popularity_reference_time = timestamps.max()
+            popularity = self._event_popularity(events_df, timestamps)
+        else:
+            popularity = np.asarray(self.interaction_matrix.sum(axis=0)).ravel()
+        self._rank_popularity(popularity)
     
-    def _get_popular_packages(self, n=5):
-        """Get popular packages for new users (cold start)."""
-        if self.interaction_matrix is None or len(self.interaction_matrix) == 0:
+    def _update_popularity(self, events_df):
+        """Add new events to the stored ranking, decaying old scores if configured."""
+        popularity = self._popularity_scores()
+        
+        timestamps = None
+        if self.popularity_half_life_days and 'timestamp' in events_df.columns:
+            timestamps = _parse_timestamps(events_df['timestamp'])
+            newest = timestamps.max()
+            reference = self.popularity_reference_time
+            if pd.notna(newest) and (pd.isna(reference) or newest > reference):
+                if pd.notna(reference):
+                    elapsed_days = (newest - reference).total_seconds() / 86400
+                    popularity *= np.power(0.5, elapsed_days / self.popularity_half_life_days)
+                self.popularity_reference_time = newest
+        
+        self._rank_popularity(popularity + self._event_popularity(events_df, timestamps))
+    
+    def _popularity_scores(self):
+        """Popularity score of each package column."""
+        popularity = np.zeros(len(self.package_ids))
+        popularity[self.popular_indices] = self.popular_scores
+        return popularity
+    
+    def _event_popularity(self, events_df, timestamps=None):
+        """Sum event weights per package, decayed to popularity_reference_time if timestamps are given."""
+        weights = events_df['weight'].to_numpy()
+        if timestamps is not None:
+            age_days = (self.popularity_reference_time - timestamps).dt.total_seconds() / 86400
+            # Events without a timestamp count as the oldest ones
+            age_days = age_days.fillna(age_days.max()).fillna(0).to_numpy()
+            weights = weights * np.power(0.5, age_days / self.popularity_half_life_days)
+        
+        positions = self.package_ids.encode(events_df['package_id'])
+        valid = (positions >= 0) & events_df['user_id'].notna().to_numpy()
+        return np.bincount(positions[valid], weights=weights[valid], minlength=len(self.package_ids))
+    
+    def _rank_popularity(self, popularity):
+        """Store packages ordered by popularity, globally and per subject."""
+        order = pd.Series(popularity).sort_values(ascending=False).index.to_numpy(dtype=np.int32)
+        self.popular_indices = order
+        self.popular_scores = popularity[order]
+        
+        ranks_by_subject = {}
+        for rank, package_id in enumerate(self.package_ids.decode(order)):
+            subject = self.package_lookup.get(package_id, {}).get('subject')
+            if isinstance(subject, str):
+                ranks_by_subject.setdefault(subject, []).append(rank)
+        self.popular_by_subject = {
+            subject: np.array(ranks, dtype=np.int32) for subject, ranks in ranks_by_subject.items()
+        }
+    
+    @_timed('popular')
+    def _get_popular_packages(self, n=5, subject=None):
+        """Get popular packages for new users (cold start), optionally for one subject."""
+        if self.popular_indices is None or self.interaction_matrix.shape[0] == 0:
+            self.metrics.increment('fallback_total', reason='no_popularity')
             return []
         
-        # Calculate package popularity
-        package_popularity = self.interaction_matrix.sum(axis=0).sort_values(ascending=False).head(n)
+        if subject is None:
+            ranks = slice(0, n)
+        elif subject in self.popular_by_subject:
+            ranks = self.popular_by_subject[subject][:n]
+        else:
+            self.metrics.increment('fallback_total', reason='unknown_subject')
+            ranks = np.empty(0, dtype=np.int32)
+        return self._popular_results(ranks)
+    
+    def _popular_results(self, ranks):
+        """Format the packages at the given popularity ranks."""
+        package_popularity = zip(
+            self.package_ids.decode(self.popular_indices[ranks]),
+            self.popular_scores[ranks]
+        )
+        return self._format_results(package_popularity, 'score', 'popular')
+
+
+def build_content_neighbours(embeddings, k=50, block_size=1024, first_row=0):
+    """
+    Top-k most similar packages for every package, excluding itself.
+    
+    `embeddings` must be L2-normalised so dot products are cosine
+    similarities. Similarities are computed one block of rows at a time,
+    so memory stays at block_size x packages instead of packages x packages.
+    With first_row, only rows from that package on are computed.
+    
+    Returns (indices, scores) as int32 / float32 arrays of shape
+    (packages - first_row, k), sorted by descending similarity.
+    """
+    n_packages = len(embeddings)
+    k = max(0, min(k, n_packages - 1))
+    indices = np.empty((n_packages - first_row, k), dtype=np.int32)
+    scores = np.empty((n_packages - first_row, k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+    
+    for start in range(first_row, n_packages, block_size):
+        block = embeddings[start:start + block_size] @ embeddings.T
+        rows = np.arange(len(block))
+        block[rows, start + rows] = -np.inf
         
-        results = []
-        for package_id, score in package_popularity.items():
-            package_info = self.packages_df[self.packages_df['package_id'] == package_id]
-            if not package_info.empty:
-                results.append({
-                    'packageId': str(package_id),
-                    'score': float(score),
-                    'title': package_info.iloc[0].get('title', ''),
-                    'subject': package_info.iloc[0].get('subject', ''),
-                    'recommendationType': 'popular'
-                })
+        top, top_scores = _top_k_rows(block, k)
+        indices[start - first_row:start - first_row + len(block)] = top
+        scores[start - first_row:start - first_row + len(block)] = top_scores
+    
+    return indices, scores
+
+
+def merge_content_neighbours(embeddings, indices, scores, first_new, block_size=1024):
+    """
+    Merge packages appended at first_new.. into the existing top-k lists.
+    
+    Each existing row only compares against the new packages and its
+    current neighbours, so adding m packages costs O(existing x m).
+    """
+    k = indices.shape[1]
+    new_columns = np.arange(first_new, len(embeddings), dtype=np.int32)
+    merged_indices = np.empty_like(indices)
+    merged_scores = np.empty_like(scores)
+    
+    for start in range(0, first_new, block_size):
+        stop = min(start + block_size, first_new)
+        similarities = embeddings[start:stop] @ embeddings[first_new:].T
+        candidates = np.hstack([indices[start:stop], np.broadcast_to(new_columns, similarities.shape)])
+        candidate_scores = np.hstack([scores[start:stop], similarities])
         
-        return results
+        top, top_scores = _top_k_rows(candidate_scores, k)
+        merged_indices[start:stop] = np.take_along_axis(candidates, top, axis=1)
+        merged_scores[start:stop] = top_scores
+    
+    return merged_indices, merged_scores
+
+
+def _row_top_k(matrix, k):
+    """
+    The k largest stored values of each CSR row, largest first (ties: lowest
+    column first). Returns (columns, values), both rows x k; rows with fewer
+    entries are padded with column -1 and value 0.
+    """
+    counts = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    order = np.lexsort((matrix.indices, -matrix.data, rows))
+    ranks = np.arange(matrix.nnz) - np.repeat(matrix.indptr[:-1], counts)
+    keep = order[ranks < k]
+    kept_rows = rows[keep]
+    slots = ranks[ranks < k]
+    
+    columns = np.full((matrix.shape[0], k), -1, dtype=np.int32)
+    values = np.zeros((matrix.shape[0], k))
+    columns[kept_rows, slots] = matrix.indices[keep]
+    values[kept_rows, slots] = matrix.data[keep]
+    return columns, values
+
+
+def _top_k_rows(matrix, k):
+    """Column positions and values of each row's k largest entries, largest first."""
+    k = min(k, matrix.shape[1])
+    if k <= 0:
+        return np.empty((len(matrix), 0), dtype=np.intp), np.empty((len(matrix), 0))
+    top = np.argpartition(-matrix, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(matrix, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _ridge_fold_in(rows, fixed_factors, regularization):
+    """Solve min ||row - fixed_factors @ x||^2 + reg * ||x||^2 for each sparse row."""
+    gram = fixed_factors.T @ fixed_factors + regularization * np.eye(fixed_factors.shape[1])
+    return np.linalg.solve(gram, np.asarray(rows @ fixed_factors).T).T
+
+
+def _parse_timestamps(values):
+    """Parse ISO 8601 timestamps (mixed precision / 'Z' suffix) as UTC; bad values become NaT."""
+    return pd.to_datetime(values, errors='coerce', utc=True, format='ISO8601')
+
+
+def _parse_embeddings(packages_df, dims=16):
+    """Parse the text_embedding column (JSON strings or arrays) into one matrix."""
+    if 'text_embedding' in packages_df.columns:
+        return parse_embedding_column(packages_df['text_embedding'])
+    # Create dummy embeddings if not available
+    return np.random.randn(len(packages_df), dims)
+
+
+def _package_lookup(packages_df):
+    """Index package display fields by package_id (first row wins)."""
+    packages = packages_df.drop_duplicates('package_id')
+    no_value = pd.Series('', index=packages.index)
+    titles = packages['title'] if 'title' in packages.columns else no_value
+    subjects = packages['subject'] if 'subject' in packages.columns else no_value
+    return {
+        package_id: {'title': title, 'subject': subject}
+        for package_id, title, subject in zip(packages['package_id'], titles, subjects)
+    }
+
+
+def _string_array(values):
+    """Fixed-width unicode array for the model's string tables."""
+    return np.array([str(v) for v in values], dtype=str)
+
+
+def _minmax_scale(values, low, high):
+    """Min-max normalise values to a known (low, high) range; no spread leaves them unchanged."""
+    return (values - low) / (high - low) if high > low else values
+
+
+def _minmax_rows(matrix):
+    """Min-max normalise each row; rows with no spread are left unchanged."""
+    row_min = matrix.min(axis=1, keepdims=True)
+    row_max = matrix.max(axis=1, keepdims=True)
+    spread = row_max - row_min
+    has_spread = spread > 0
+    return np.where(has_spread, (matrix - row_min) / np.where(has_spread, spread, 1.0), matrix)
+
+
+def _stopwatch(timings, metrics):
+    """
+    Return lap(stage), which records the seconds since the previous lap in
+    timings and in the train_stage_seconds histogram of metrics.
+    """
+    last = [time.perf_counter()]
+    
+    def lap(stage):
+        now = time.perf_counter()
+        timings[stage] = now - last[0]
+        metrics.observe('train_stage_seconds', timings[stage], stage=stage)
+        last[0] = now
+    return lap
+
+
+class RecommenderService:
+    """
+    Long-lived wrapper around HybridRecommender for the `serve` command.
+
+    Loads the model once and hot-reloads it when a new model version is
+    published. Requests always run against a fully loaded model: a reload
+    builds a new HybridRecommender and swaps the reference, so in-flight
+    requests finish on the old one.
+
+    Responses to recommend, similar and popular are cached per (model
+    version, command, id, n, weights) in a bounded LRU with a TTL; popular
+    and similar lists are precomputed when a model is loaded. Loading a new
+    version empties the cache.
+    """
+
+    def __init__(self, model_dir='models', reload_interval=2.0, cache_size=10000, cache_ttl=300.0,
+                 precompute_sizes=(5,), max_precomputed=20000):
+        self.model_dir = model_dir
+        self.reload_interval = reload_interval
+        self.precompute_sizes = precompute_sizes
+        self.max_precomputed = max_precomputed
+        self.cache = ResultCache(max_entries=cache_size, ttl=cache_ttl)
+        self.precomputed = {}
+        self.recommender = None
+        self._store = HybridRecommender(model_dir=model_dir)
+        self._failed_version = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        recommender = HybridRecommender(model_dir=self.model_dir)
+        # Raises a descriptive FileNotFoundError if the model is missing
+        recommender.load_model()
+        # Cached responses carry the model version in their key, so entries
+        # of the previous model can never be served; drop them to free memory
+        self.precomputed = self._precompute(recommender)
+        self.cache.clear()
+        self.recommender = recommender
+
+    def _precompute(self, recommender):
+        """Cache entries for the popular and similar-package lists of a freshly loaded model."""
+        precomputed = {}
+        for n in self.precompute_sizes:
+            lists = recommender.precompute_lists(n, max_similar=self.max_precomputed)
+            for subject, results in lists['popular'].items():
+                key = result_cache_key(recommender.model_version, 'popular', {'subject': subject, 'n': n})
+                precomputed[key] = {'success': True, 'recommendations': results}
+            for package_id, results in lists['similar'].items():
+                key = result_cache_key(recommender.model_version, 'similar', {'packageId': package_id, 'n': n})
+                precomputed[key] = {'success': True, 'similar': results}
+        return precomputed
+
+    def get_recommender(self):
+        """Return the current model, reloading it first if a new version was published."""
+        now = time.monotonic()
+        if self.recommender is not None and now - self._last_check < self.reload_interval:
+            return self.recommender
+
+        with self._lock:
+            if self.recommender is None or now - self._last_check >= self.reload_interval:
+                self._last_check = now
+                version = self._store.published_version()
+                if self.recommender is None:
+                    self._load()
+                elif version not in (None, self.recommender.model_version, self._failed_version):
+                    try:
+                        self._load()
+                        REGISTRY.increment('model_reloads_total', result='ok')
+                    except Exception as e:
+                        # Keep serving the previous model if the new one is unreadable
+                        self._failed_version = version
+                        REGISTRY.increment('model_reloads_total', result='failed')
+                        print(f"⚠ Model reload failed, keeping previous model: {e}", file=sys.stderr)
+        return self.recommender
+
+    def handle(self, request):
+        """Answer a single request dict and return the response dict."""
+        response = {}
+        if 'id' in request:
+            response['id'] = request['id']
+        command = request.get('command')
+        try:
+            if command == 'metrics':
+                # Answered without a model, so it also works before the first training
+                response.update(metrics_response(request))
+            else:
+                response.update(self._answer(self.get_recommender(), command, request))
+        except Exception as e:
+            REGISTRY.increment('request_errors_total', command=str(command))
+            response['error'] = str(e)
+        return response
+
+    def _answer(self, recommender, command, request):
+        """Return a cached response if there is one, otherwise compute and cache it."""
+        key = result_cache_key(recommender.model_version, command, request)
+        if key is None:
+            return handle_command(recommender, command, request)
+
+        result = self.precomputed.get(key)
+        if result is None:
+            result = self.cache.get(key)
+        if result is not None:
+            REGISTRY.increment('result_cache_total', command=command, result='hit')
+            return result
+
+        REGISTRY.increment('result_cache_total', command=command, result='miss')
+        result = handle_command(recommender, command, request)
+        self.cache.put(key, result)
+        return result
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of command responses with a time-to-live.
+
+    Cached responses are shared between requests and must not be mutated.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached value for key, or None if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Store value, evicting the least recently used entries beyond max_entries."""
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Request field identifying the subject of each cacheable command
+CACHED_COMMANDS = {'recommend': 'userId', 'similar': 'packageId', 'popular': 'subject'}
+
+
+def result_cache_key(model_version, command, input_data):
+    """
+    Cache key (model version, command, id, n, weights) for a request, or
+    None if the command is not cached or the request fields are unhashable.
+    """
+    id_field = CACHED_COMMANDS.get(command)
+    if id_field is None:
+        return None
+    key = (
+        model_version, command, input_data.get(id_field), input_data.get('n', 5),
+        input_data.get('collaborativeWeight', 0.6), input_data.get('contentWeight', 0.4)
+    )
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def metrics_response(input_data, registry=REGISTRY):
+    """Metrics as JSON (default) or Prometheus text with {"format": "prometheus"}."""
+    if input_data.get('format') == 'prometheus':
+        return {'success': True, 'metrics': registry.to_prometheus()}
+    return {'success': True, 'metrics': registry.snapshot()}
+
+
+def handle_command(recommender, command, input_data):
+    """Dispatch a CLI/protocol command against a loaded recommender."""
+    if command == 'recommend':
+        user_id = input_data.get('userId')
+        n = input_data.get('n', 5)
+        recommendations = recommender.recommend(
+            user_id, n=n,
+            collaborative_weight=input_data.get('collaborativeWeight', 0.6),
+            content_weight=input_data.get('contentWeight', 0.4)
+        )
+        return {'success': True, 'recommendations': recommendations}
+
+    if command == 'recommend-batch':
+        user_ids = input_data.get('userIds', [])
+        n = input_data.get('n', 5)
+        recommendations = recommender.recommend_batch(
+            user_ids, n=n,
+            collaborative_weight=input_data.get('collaborativeWeight', 0.6),
+            content_weight=input_data.get('contentWeight', 0.4)
+        )
+        return {'success': True, 'recommendations': recommendations}
+
+    if command == 'popular':
+        n = input_data.get('n', 5)
+        popular = recommender._get_popular_packages(n, subject=input_data.get('subject'))
+        return {'success': True, 'recommendations': popular}
+
+    if command == 'similar':
+        package_id = input_data.get('packageId')
+        n = input_data.get('n', 5)
+        similar = recommender.get_similar_packages(package_id, n=n)
+        return {'success': True, 'similar': similar}
+
+    raise ValueError(f'Unknown command: {command}')
+
+
+def serve_stream(service, in_stream, out_stream, max_workers=4):
+    """
+    Answer newline-delimited JSON requests from in_stream concurrently.
+
+    Each response is written as one line and echoes the request `id`, so
+    callers can match responses that complete out of order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    write_lock = threading.Lock()
+
+    def respond(line):
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            response = {'error': f'Invalid JSON request: {e}'}
+        else:
+            response = service.handle(request)
+        with write_lock:
+            out_stream.write(json.dumps(response) + '\n')
+            out_stream.flush()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for line in in_stream:
+            line = line.strip()
+            if line:
+                pool.submit(respond, line)
+
+
+class _SocketWriter:
+    """Text-mode adapter over a socket's binary write file."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def serve(argv):
+    """Run the recommender as a persistent service (stdin/stdout or socket)."""
+    import argparse
+    import socketserver
+
+    parser = argparse.ArgumentParser(prog='hybrid_recommender.py serve')
+    parser.add_argument('--model-dir', default='models', help='Directory holding the trained model')
+    parser.add_argument('--socket', help='Listen on a Unix domain socket at this path')
+    parser.add_argument('--port', type=int, help='Listen on 127.0.0.1:PORT instead of stdin/stdout')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent requests per stream')
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help='Seconds between model file change checks')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='Cached responses kept per model version (0 disables the cache)')
+    parser.add_argument('--cache-ttl', type=float, default=300.0,
+                        help='Seconds a cached response stays valid (0 keeps it until the next model)')
+    parser.add_argument('--precompute-n', type=int, nargs='+', default=[5],
+                        help='List sizes of popular/similar responses precomputed at load')
+    args = parser.parse_args(argv)
+
+    service = RecommenderService(
+        model_dir=args.model_dir, reload_interval=args.reload_interval,
+        cache_size=args.cache_size, cache_ttl=args.cache_ttl, precompute_sizes=tuple(args.precompute_n)
+    )
+    try:
+        service.get_recommender()
+    except FileNotFoundError as e:
+        # Keep running: requests report the error until a model is trained
+        print(f"⚠ {e}", file=sys.stderr)
+
+    if args.socket is None and args.port is None:
+        print("✓ Serving newline-delimited JSON on stdin/stdout", file=sys.stderr)
+        serve_stream(service, sys.stdin, sys.stdout, max_workers=args.workers)
+        return
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            reader = (line.decode('utf-8') for line in self.rfile)
+            writer = _SocketWriter(self.wfile)
+            serve_stream(service, reader, writer, max_workers=args.workers)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = socketserver.ThreadingUnixStreamServer(args.socket, Handler)
+        address = args.socket
+    else:
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', args.port), Handler)
+        address = f'127.0.0.1:{args.port}'
+
+    server.daemon_threads = True
+    print(f"✓ Serving newline-delimited JSON on {address}", file=sys.stderr)
+    with server:
+        server.serve_forever()
 
 
 def main():
@@ -291,38 +1744,34 @@ def main():
         sys.exit(1)
     
     command = sys.argv[1]
+    
+    if command == 'serve':
+        serve(sys.argv[2:])
+        return
+    
     recommender = HybridRecommender()
     
+    if command == 'convert':
+        # Convert models/hybrid_model.pkl into the versioned array format
+        try:
+            version = recommender.convert_legacy_model()
+            print(json.dumps({'success': True, 'version': version}))
+        except Exception as e:
+            print(json.dumps({'error': str(e)}))
+            sys.exit(1)
+        return
+    
     try:
-        if command == 'recommend':
-            # Load model
-            recommender.load_model()
-            
-            # Get user_id from stdin
-            input_data = json.loads(sys.stdin.read())
-            user_id = input_data.get('userId')
-            n = input_data.get('n', 5)
-            
-            # Get recommendations
-            recommendations = recommender.recommend(user_id, n=n)
-            print(json.dumps({'success': True, 'recommendations': recommendations}))
-            
-        elif command == 'similar':
-            # Load model
-            recommender.load_model()
-            
-            # Get package_id from stdin
-            input_data = json.loads(sys.stdin.read())
-            package_id = input_data.get('packageId')
-            n = input_data.get('n', 5)
-            
-            # Get similar packages
-            similar = recommender.get_similar_packages(package_id, n=n)
-            print(json.dumps({'success': True, 'similar': similar}))
-            
-        else:
+        if command not in ('recommend', 'recommend-batch', 'similar', 'popular'):
             print(json.dumps({'error': f'Unknown command: {command}'}))
             sys.exit(1)
+        
+        # Load model
+        recommender.load_model()
+        
+        # Get userId / userIds / packageId from stdin
+        input_data = json.loads(sys.stdin.read())
+        print(json.dumps(handle_command(recommender, command, input_data)))
             
     except Exception as e:
         print(json.dumps({'error': str(e)}))
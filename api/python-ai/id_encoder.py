@@ -0,0 +1,59 @@
+"""
+String id <-> dense integer code mapping for users and packages.
+
+User and package ids (24-character ObjectId strings) only exist at the API
+boundary: requests are encoded once to int32 codes, every matrix, neighbour
+table and interaction list inside the model is indexed by code, and codes
+are decoded back to strings when results are formatted. Codes are
+positions in the model's arrays and are append-only, so adding ids never
+moves existing rows. The id table is saved with the model as a fixed-width
+unicode array (see model_store.py).
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class IdEncoder:
+    """Append-only mapping between string ids and int32 codes 0..len-1."""
+
+    def __init__(self, ids=()):
+        self._index = pd.Index(np.asarray(ids, dtype=object), dtype=object)
+
+    @property
+    def ids(self):
+        """Ids in code order (object array, not a copy)."""
+        return self._index.values
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, value):
+        return value in self._index
+
+    def code(self, value):
+        """Code of one id, or -1 if it is unknown."""
+        try:
+            position = self._index.get_loc(value)
+        except (KeyError, TypeError):
+            return -1
+        return position if isinstance(position, int) else -1
+
+    def encode(self, values):
+        """Codes of many ids as an int32 array (-1 for unknown ids)."""
+        return self._index.get_indexer(values).astype(np.int32)
+
+    def decode(self, codes):
+        """Ids of the given codes."""
+        return self.ids[codes]
+
+    def extend(self, values):
+        """Append the ids in values that are not known yet; returns their new codes."""
+        first_new = len(self._index)
+        new_ids = pd.Index(pd.unique(np.asarray(values, dtype=object)), dtype=object)
+        self._index = self._index.append(new_ids.difference(self._index, sort=False))
+        return np.arange(first_new, len(self._index), dtype=np.int32)
+
+    def to_array(self):
+        """Fixed-width unicode array of the ids, for model_store."""
+        return np.array([str(v) for v in self.ids], dtype=str)
@@ -0,0 +1,184 @@
+"""
+Vectorized interaction weighting for training.
+
+Turns a frame of events (user_id, package_id, event_type and optionally
+timestamp) into one weight per (user, package) pair, ready for a
+scipy.sparse constructor. Everything runs as grouped NumPy operations over
+integer codes, in one pass, without per-row Python mapping or a pivot:
+
+    1. event types become categorical codes; each code looks up its weight
+    2. burst dedup: a repeat of the same (user, package, type) less than
+       burst_seconds after the previous one is dropped
+    3. exponential time decay by age relative to the newest event
+    4. per-type caps on the summed weight of one type for one pair, so that
+       forty views cannot outweigh a booking
+    5. the capped per-type sums are added up per (user, package)
+
+Events without a timestamp are never treated as bursts and decay as the
+oldest events.
+
+Pre-aggregated exports (train_model.py --aggregate) carry one row per
+(user, package, type) with a count column and the newest timestamp: a row
+weighs count events, decays as if all of them happened at that timestamp,
+and is never treated as a burst.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from id_encoder import IdEncoder
+
+EPOCH = pd.Timestamp(0, tz='UTC')
+
+
+class InteractionWeights(namedtuple('InteractionWeights',
+                                    'rows columns values user_ids package_ids reference_time')):
+    """
+    Summed weight per (user, package) pair in coordinate form.
+
+    rows / columns are codes of user_ids / package_ids (IdEncoders); reference_time
+    is the time weights were decayed to (None without decay).
+    """
+
+    def to_csr(self):
+        """The users x packages CSR interaction matrix (zero weights dropped)."""
+        matrix = sp.csr_matrix(
+            (self.values, (self.rows, self.columns)),
+            shape=(len(self.user_ids), len(self.package_ids))
+        )
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        return matrix
+
+
+def event_type_weights(event_types, event_weights, default_weight, counts=None):
+    """
+    Weight of each event from its type, via categorical codes.
+
+    Returns (weights, types): a float64 array and the pd.Categorical of the
+    types. Types missing from event_weights (and missing types) get
+    default_weight. With counts (events per row), each weight is multiplied
+    by its row's count.
+    """
+    types = pd.Categorical(event_types)
+    # Code -1 (missing type) indexes the trailing default
+    lookup = np.array([event_weights.get(t, default_weight) for t in types.categories] + [default_weight],
+                      dtype=np.float64)
+    weights = lookup[types.codes]
+    if counts is not None:
+        weights = weights * np.asarray(counts, dtype=np.float64)
+    return weights, types
+
+
+def timestamp_seconds(values):
+    """Seconds since the epoch (float64) of ISO 8601 timestamps; unparseable values are NaN."""
+    timestamps = pd.to_datetime(values, errors='coerce', utc=True, format='ISO8601')
+    return (timestamps - EPOCH).dt.total_seconds().to_numpy(dtype=np.float64)
+
+
+def weight_interactions(events_df, event_weights, default_weight, half_life_days=None,
+                        type_caps=None, burst_seconds=None, reference_time=None,
+                        user_ids=None, package_ids=None):
+    """
+    Weight events and sum them per (user, package).
+
+    Parameters:
+    -----------
+    events_df : DataFrame with user_id, package_id, event_type and
+        (for decay and burst dedup) timestamp columns; an optional count
+        column marks pre-aggregated rows
+    event_weights : dict
+        Weight per event type
+    default_weight : float
+        Weight of event types not in event_weights
+    half_life_days : float or None
+        Halve an event's weight per this many days of age (no decay if None)
+    type_caps : dict or None
+        Maximum summed weight of one event type for one (user, package)
+    burst_seconds : float or None
+        Drop repeats of the same (user, package, type) closer than this to
+        the previous one
+    reference_time : pd.Timestamp or None
+        Time the decay is relative to (default: the newest event)
+    user_ids, package_ids : IdEncoder or None
+        Fixed row / column codes. Events with ids outside them are dropped.
+        Default: encoders of the events' ids in sorted order.
+
+    Returns:
+    --------
+    InteractionWeights
+    """
+    events = events_df[(events_df['user_id'].notna() & events_df['package_id'].notna()).to_numpy()]
+    user_codes, user_ids = _codes(events['user_id'], user_ids)
+    package_codes, package_ids = _codes(events['package_id'], package_ids)
+    counts = events['count'].to_numpy() if 'count' in events.columns else None
+    weights, types = event_type_weights(events['event_type'], event_weights, default_weight, counts)
+    type_codes = types.codes.astype(np.int64)
+
+    seconds = None
+    if (half_life_days or burst_seconds) and 'timestamp' in events.columns:
+        seconds = timestamp_seconds(events['timestamp'])
+
+    keep = (user_codes >= 0) & (package_codes >= 0)
+    if burst_seconds and seconds is not None and counts is None:
+        keep &= ~_bursts(user_codes, package_codes, type_codes, seconds, burst_seconds)
+    if not keep.all():
+        user_codes, package_codes, type_codes, weights = (
+            user_codes[keep], package_codes[keep], type_codes[keep], weights[keep]
+        )
+        seconds = seconds[keep] if seconds is not None else None
+
+    if half_life_days and seconds is not None:
+        if reference_time is None and not np.isnan(seconds).all():
+            reference_time = (EPOCH + pd.Timedelta(seconds=np.nanmax(seconds))).round('us')
+        if reference_time is not None:
+            age_days = ((reference_time - EPOCH).total_seconds() - seconds) / 86400
+            # Events without a timestamp count as the oldest ones
+            age_days[np.isnan(age_days)] = np.nanmax(age_days) if not np.isnan(age_days).all() else 0.0
+            weights = weights * np.power(0.5, age_days / half_life_days)
+    else:
+        reference_time = None
+
+    pairs = user_codes * len(package_ids) + package_codes
+    if type_caps:
+        # Sum per (pair, type), cap, then fold the types into the pair
+        n_types = len(types.categories) + 1
+        keys, inverse = np.unique(pairs * n_types + type_codes % n_types, return_inverse=True)
+        caps = np.full(n_types, np.inf)
+        for event_type, cap in type_caps.items():
+            if event_type in types.categories:
+                caps[types.categories.get_loc(event_type)] = cap
+        weights = np.minimum(np.bincount(inverse, weights=weights), caps[keys % n_types])
+        pairs = keys // n_types
+
+    unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+    return InteractionWeights(
+        rows=unique_pairs // max(len(package_ids), 1),
+        columns=unique_pairs % max(len(package_ids), 1),
+        values=np.bincount(inverse, weights=weights, minlength=len(unique_pairs)),
+        user_ids=user_ids,
+        package_ids=package_ids,
+        reference_time=reference_time
+    )
+
+
+def _codes(values, encoder):
+    """Integer codes of values in encoder (-1 if absent), or in a new encoder of their sorted ids."""
+    if encoder is None:
+        codes, ids = pd.factorize(values, sort=True)
+        return codes.astype(np.int64), IdEncoder(ids)
+    return encoder.encode(values).astype(np.int64), encoder
+
+
+def _bursts(user_codes, package_codes, type_codes, seconds, burst_seconds):
+    """Mask of events less than burst_seconds after the previous event with the same key."""
+    order = np.lexsort((seconds, type_codes, package_codes, user_codes))
+    same_key = ((np.diff(user_codes[order]) == 0) & (np.diff(package_codes[order]) == 0)
+                & (np.diff(type_codes[order]) == 0))
+    # NaN gaps (missing timestamps) compare False, so they are kept
+    burst = np.zeros(len(order), dtype=bool)
+    burst[order[1:]] = same_key & (np.diff(seconds[order]) < burst_seconds)
+    return burst
@@ -1,9 +1,18 @@
 """
 Merge real user data into the test dataset for training
+
+Real events are appended to the dataset's event store
+(ML/recommender_dataset/event_store/) instead of rewriting events.csv, and
+only events not already in events.csv or the store are added, so running
+the merge again is a no-op. train_from_csv.py reads both.
 """
 
 import pandas as pd
 from pathlib import Path
+from csv_loader import (read_typed_csv, load_dataset_csv, INTERACTION_DTYPES, USER_DTYPES,
+                        PACKAGE_DTYPES, TRAINING_COLUMNS)
+from event_store import EventStore, EVENT_COLUMNS
+from hybrid_recommender import EVENT_WEIGHTS, DEFAULT_EVENT_WEIGHT
 
 script_dir = Path(__file__).parent
 real_data_path = script_dir / 'data' / 'interactions.csv'
@@ -15,65 +24,57 @@ print("=" * 80)
 
 # Load real user interactions
 print(f"\n[1/4] Loading real user data from {real_data_path}...")
-real_df = pd.read_csv(real_data_path)
+real_df = read_typed_csv(real_data_path, INTERACTION_DTYPES)
 print(f"✓ Loaded {len(real_df)} real interactions from {real_df['user_id'].nunique()} users")
 
 # Load test dataset
 print(f"\n[2/4] Loading test dataset from {ml_data_dir}...")
-test_events = pd.read_csv(ml_data_dir / 'events.csv')
-test_packages = pd.read_csv(ml_data_dir / 'packages.csv')
-test_users = pd.read_csv(ml_data_dir / 'users.csv')
+test_events = load_dataset_csv(ml_data_dir, 'events.csv', columns=TRAINING_COLUMNS['events.csv'])
+test_packages = read_typed_csv(ml_data_dir / 'packages.csv', PACKAGE_DTYPES, columns=['packageId'])
+test_users = read_typed_csv(ml_data_dir / 'users.csv', USER_DTYPES, columns=['userId'])
+store = EventStore(ml_data_dir / 'event_store')
 print(f"✓ Test dataset: {len(test_events)} events, {len(test_packages)} packages, {len(test_users)} users")
 
 # Convert real data to match test format
 print(f"\n[3/4] Converting real data to test format...")
 
-# Map real package IDs to test package IDs (use first 13 test packages)
-real_package_ids = real_df['package_id'].unique()
-test_package_ids = test_packages['packageId'].head(13).tolist()
-package_id_mapping = dict(zip(real_package_ids, test_package_ids))
-
-# Create new events from real data
-new_events = []
-for _, row in real_df.iterrows():
-    new_events.append({
-        'userId': row['user_id'],
-        'packageId': package_id_mapping.get(row['package_id'], test_package_ids[0]),
-        'eventType': row['interaction_type'],
-        'timestamp': row['timestamp']
-    })
-
-new_events_df = pd.DataFrame(new_events)
-print(f"✓ Created {len(new_events_df)} new events")
-
-# Add real users to users dataset
-real_user_ids = real_df['user_id'].unique()
-new_users = []
-for user_id in real_user_ids:
-    if user_id not in test_users['userId'].values:
-        new_users.append({'userId': user_id})
+# Map real package IDs to test package IDs (use first 13 test packages);
+# packages beyond those map to the first test package
+real_package_ids = real_df['package_id'].astype(object).unique()
+test_package_ids = test_packages['packageId'].astype(object).head(13).to_numpy()
+mapped = min(len(real_package_ids), len(test_package_ids))
+package_id_mapping = pd.Series(test_package_ids[:mapped], index=real_package_ids[:mapped])
 
-if new_users:
-    new_users_df = pd.DataFrame(new_users)
-    test_users = pd.concat([test_users, new_users_df], ignore_index=True)
-    print(f"✓ Added {len(new_users)} new users")
+event_types = real_df['interaction_type'].astype(object)
+new_events_df = pd.DataFrame({
+    'user_id': real_df['user_id'].astype(object),
+    'event_type': event_types,
+    'package_id': real_df['package_id'].astype(object).map(package_id_mapping).fillna(test_package_ids[0]),
+    'timestamp': real_df['timestamp'],
+    'weight': event_types.map(EVENT_WEIGHTS).fillna(DEFAULT_EVENT_WEIGHT).to_numpy()
+}, columns=EVENT_COLUMNS)
+print(f"✓ Converted {len(new_events_df)} real events")
 
-# Merge events
-merged_events = pd.concat([test_events, new_events_df], ignore_index=True)
-print(f"✓ Total events: {len(merged_events)}")
+# Users not in users.csv yet (anti-join on the id sets)
+real_user_ids = pd.Index(real_df['user_id'].astype(object).unique())
+new_user_ids = real_user_ids.difference(pd.Index(test_users['userId'].astype(object)), sort=False)
 
-# Save merged dataset
-print(f"\n[4/4] Saving merged dataset...")
-merged_events.to_csv(ml_data_dir / 'events.csv', index=False)
-test_users.to_csv(ml_data_dir / 'users.csv', index=False)
+# Append only what is new
+print(f"\n[4/4] Appending new data...")
+added_events = store.append_new(new_events_df, 'real', existing_df=test_events)
+print(f"✓ Added {added_events} new events to {store.root} "
+      f"({len(new_events_df) - added_events} already merged)")
 
-print(f"✓ Saved to {ml_data_dir}")
-print(f"  - events.csv: {len(merged_events)} rows")
-print(f"  - users.csv: {len(test_users)} rows")
-print(f"  - packages.csv: {len(test_packages)} rows (unchanged)")
+if len(new_user_ids):
+    users_path = ml_data_dir / 'users.csv'
+    header = list(pd.read_csv(users_path, nrows=0).columns)
+    pd.DataFrame({'userId': new_user_ids}).reindex(columns=header).to_csv(
+        users_path, mode='a', header=False, index=False
+    )
+print(f"✓ Added {len(new_user_ids)} new users to users.csv")
 
 print("\n" + "=" * 80)
 print("✅ MERGE COMPLETE!")
 print("=" * 80)
 print("\nNow retrain the model with: python train_from_csv.py")
-print(f"\nReal user IDs added: {list(real_user_ids)}")
+print(f"\nReal user IDs: {list(real_user_ids)}")
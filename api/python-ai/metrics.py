@@ -0,0 +1,156 @@
+"""
+In-process metrics for the recommender.
+
+Counters, gauges and timing histograms are kept in a thread-safe registry
+and never printed: stdout carries the JSON protocol used by the Node.js API.
+Read them with `snapshot()` (JSON-serialisable) or `to_prometheus()` (text
+exposition format), e.g. through the `metrics` command of
+`hybrid_recommender.py serve`.
+
+    from metrics import REGISTRY
+
+    with REGISTRY.timer('request_seconds', method='recommend'):
+        ...
+    REGISTRY.increment('fallback_total', reason='cold_start')
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'focusdesk_recommender_'
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and timing histograms keyed by name and labels."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timers = {}
+
+    def increment(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to value."""
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in a timing histogram."""
+        key = (name, _label_key(labels))
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = {
+                    'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(self.buckets) + 1)
+                }
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['buckets'][bucket] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the enclosed block (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def record_shape(self, matrix_name, array):
+        """Record the rows/columns of a matrix as gauges (skipped if it is None)."""
+        if array is None:
+            return
+        shape = tuple(array.shape) + (1,) * (2 - len(array.shape))
+        self.set_gauge('matrix_rows', shape[0], matrix=matrix_name)
+        self.set_gauge('matrix_columns', shape[1], matrix=matrix_name)
+
+    def reset(self):
+        """Drop all recorded values."""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timers.clear()
+
+    def snapshot(self):
+        """All metrics as a JSON-serialisable dict."""
+        with self._lock:
+            counters = [_entry(key, value=value) for key, value in sorted(self._counters.items())]
+            gauges = [_entry(key, value=value) for key, value in sorted(self._gauges.items())]
+            timers = [
+                _entry(key, count=timer['count'], sum=timer['sum'], max=timer['max'],
+                       mean=timer['sum'] / timer['count'])
+                for key, timer in sorted(self._timers.items())
+            ]
+        return {'counters': counters, 'gauges': gauges, 'timers': timers}
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            timers = sorted((key, dict(timer, buckets=list(timer['buckets'])))
+                            for key, timer in self._timers.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            metric = PREFIX + name
+            declare(metric, 'counter')
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+        for (name, labels), value in gauges:
+            metric = PREFIX + name
+            declare(metric, 'gauge')
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+        for (name, labels), timer in timers:
+            metric = PREFIX + name
+            declare(metric, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), timer['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {timer["sum"]}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {timer["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _entry(key, **values):
+    name, labels = key
+    return {'name': name, 'labels': dict(labels), **values}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# Process-wide registry shared by recommenders, reloads and the serve loop
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,129 @@
+"""
+Versioned on-disk storage for the recommender model.
+
+Each model version is a directory of `.npy` arrays plus a JSON manifest:
+
+    models/hybrid_model/
+        CURRENT                  <- name of the published version
+        20261017T010203123456Z/
+            manifest.json
+            user_factors.npy
+            user_ids.npy         <- string tables are fixed-width unicode arrays
+            ...
+
+Arrays are loaded with `np.load(mmap_mode='r')`, so worker processes share
+the page cache and start without copying the model into their heap. Nothing
+is unpickled (`allow_pickle=False`).
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_VERSION = 1
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+
+def new_version():
+    """Version names sort chronologically (UTC timestamp)."""
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+
+
+def write_version(root, arrays, manifest):
+    """
+    Write arrays and manifest as a new version directory under root.
+
+    The directory is written under a temporary name and renamed into place,
+    so readers never see a partial version. Returns the version name.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    version = new_version()
+    tmp_dir = root / f'.tmp-{version}'
+    tmp_dir.mkdir()
+
+    try:
+        array_info = {}
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            np.save(tmp_dir / f'{name}.npy', array, allow_pickle=False)
+            array_info[name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+        manifest = dict(manifest)
+        manifest.update({
+            'format_version': FORMAT_VERSION,
+            'version': version,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'arrays': array_info
+        })
+        with open(tmp_dir / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        os.replace(tmp_dir, root / version)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return version
+
+
+def publish(root, version, keep=3):
+    """Point CURRENT at version atomically and prune old versions."""
+    root = Path(root)
+    tmp_path = root / f'{CURRENT_FILE}.tmp'
+    tmp_path.write_text(version)
+    os.replace(tmp_path, root / CURRENT_FILE)
+
+    versions = sorted(p.name for p in root.iterdir() if p.is_dir() and not p.name.startswith('.'))
+    for old_version in versions[:-keep] if keep else []:
+        if old_version != version:
+            # Mapped files of a running process may block deletion on Windows
+            shutil.rmtree(root / old_version, ignore_errors=True)
+
+
+def current_version(root):
+    """Name of the published version, or None if nothing is published."""
+    try:
+        return (Path(root) / CURRENT_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_version(root, version=None, mmap=True):
+    """
+    Load a version's manifest and arrays (the published one by default).
+
+    Returns (manifest, arrays) where arrays maps name -> np.ndarray, memory
+    mapped read-only when mmap is True.
+    """
+    root = Path(root)
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No published model version in {root}")
+
+    version_dir = root / version
+    with open(version_dir / MANIFEST_FILE) as f:
+        manifest = json.load(f)
+
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported model format {manifest.get('format_version')} in {version_dir}"
+        )
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {
+        name: np.load(version_dir / f'{name}.npy', mmap_mode=mmap_mode, allow_pickle=False)
+        for name in manifest['arrays']
+    }
+    return manifest, arrays
+
+
+def version_size(root, version=None):
+    """Total size in bytes of a version directory."""
+    version_dir = Path(root) / (version or current_version(root))
+    return sum(p.stat().st_size for p in version_dir.iterdir())
@@ -0,0 +1,209 @@
+"""
+Second-stage learning-to-rank model for HybridRecommender.
+
+The hybrid score ranks the whole catalogue; the re-ranker only re-orders a
+short candidate list per user (the best packages by collaborative score,
+by content similarity and by popularity) from one feature row per
+candidate:
+
+    hybrid_score, collaborative_score, content_score    first-stage scores (0..1 per user)
+    generator_origin_cf / _embedding / _popularity      candidate lists it came from
+    package_language_match,
+    user_pref_subjects_count_match                      user/package label overlap
+    package_price, package_sessions, package_avg_rating,
+    package_popularity_7d                               catalogue features
+
+Features of a whole request batch are assembled as one matrix and scored
+by a linear model: missing values are imputed with the training means,
+columns standardised and dotted with the weights. The model is a few small
+arrays saved with the recommender (see model_store.py).
+
+It is fitted by ridge regression on the graded labels of
+ML/recommender_dataset/ranking_examples.csv (booking 1.0, click 0.2,
+view 0.05, else 0). Every feature is recomputed by the trained model for
+each example's user and package, origin flags included, so training sees
+the same values serving does; content_score stands in for the file's
+text_similarity_score. The file's user-only and context columns (age,
+academic level, time of day, ...) are the same for every candidate of a
+request, so a linear model could not use them to re-order candidates.
+
+The label overlap features compare a user's labels (users.csv language,
+learningPreferences_subjects) with a package's (packages.csv languages,
+subject). Label sets are stored as int64 bit masks over a per-feature
+vocabulary; -1 marks an unknown set, and its features are NaN.
+"""
+
+import numpy as np
+import pandas as pd
+
+ORIGIN_FEATURES = ['generator_origin_cf', 'generator_origin_embedding', 'generator_origin_popularity']
+
+LABEL_FEATURES = ['package_language_match', 'user_pref_subjects_count_match']
+
+PACKAGE_FEATURES = ['package_price', 'package_sessions', 'package_avg_rating', 'package_popularity_7d']
+
+RANKING_FEATURES = (['hybrid_score', 'collaborative_score', 'content_score'] + ORIGIN_FEATURES
+                    + LABEL_FEATURES + PACKAGE_FEATURES)
+
+# (users_df column, packages_df column) whose '|'-separated labels each overlap feature compares
+LABEL_FEATURE_COLUMNS = {
+    'package_language_match': ('language', 'languages'),
+    'user_pref_subjects_count_match': ('learningPreferences_subjects', 'subject'),
+}
+
+# Bits of an int64 mask; labels past this many in a vocabulary get none
+MAX_LABELS = 63
+
+# packages_df columns each catalogue feature is read from (first present wins)
+PACKAGE_FEATURE_COLUMNS = {
+    'package_price': ('price', 'rate'),
+    'package_sessions': ('sessions',),
+    'package_avg_rating': ('avgRating',),
+}
+
+
+class LinearRanker:
+    """Linear scoring model over standardised RANKING_FEATURES columns."""
+
+    def __init__(self, features, means, scales, weights, bias):
+        self.features = list(features)
+        self.means = means
+        self.scales = scales
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def fit(cls, features_matrix, labels, features=RANKING_FEATURES, regularization=1.0):
+        """
+        Ridge regression of labels on the standardised feature columns.
+
+        Parameters:
+        -----------
+        features_matrix : array (examples, features), NaN for missing values
+        labels : array (examples,)
+            Graded relevance of each example
+        regularization : float
+            L2 penalty on the weights (the bias is not penalised)
+        """
+        X = np.asarray(features_matrix, dtype=np.float64)
+        y = np.asarray(labels, dtype=np.float64)
+        means = np.nanmean(X, axis=0) if len(X) else np.zeros(X.shape[1])
+        means = np.where(np.isnan(means), 0.0, means)
+        X = np.where(np.isnan(X), means, X)
+        scales = X.std(axis=0)
+        scales = np.where(scales > 0, scales, 1.0)
+        Z = (X - means) / scales
+
+        bias = y.mean() if len(y) else 0.0
+        gram = Z.T @ Z + regularization * np.eye(Z.shape[1])
+        weights = np.linalg.solve(gram, Z.T @ (y - bias))
+        return cls(features, means, scales, weights, np.float64(bias))
+
+    def score(self, features_matrix):
+        """Scores of each row of features_matrix (NaN features count as the training mean)."""
+        X = np.where(np.isnan(features_matrix), self.means, features_matrix)
+        return ((X - self.means) / self.scales) @ self.weights + self.bias
+
+    def arrays(self, prefix):
+        """Arrays for model_store, named <prefix>_features/_means/_scales/_weights/_bias."""
+        return {
+            f'{prefix}_features': np.array(self.features, dtype=str),
+            f'{prefix}_means': self.means,
+            f'{prefix}_scales': self.scales,
+            f'{prefix}_weights': self.weights,
+            f'{prefix}_bias': np.array([self.bias]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        """Ranker stored by arrays(prefix), or None if the model has none."""
+        if f'{prefix}_weights' not in arrays:
+            return None
+        return cls([str(f) for f in arrays[f'{prefix}_features']], arrays[f'{prefix}_means'],
+                   arrays[f'{prefix}_scales'], arrays[f'{prefix}_weights'], arrays[f'{prefix}_bias'][0])
+
+
+def package_feature_matrix(packages_df, popularity_7d=None):
+    """
+    Catalogue features (PACKAGE_FEATURES order) of each row of packages_df.
+
+    Returns float32 (packages, 4); columns packages_df lacks, and
+    package_popularity_7d without popularity_7d, are NaN.
+    """
+    matrix = np.full((len(packages_df), len(PACKAGE_FEATURES)), np.nan, dtype=np.float32)
+    for i, feature in enumerate(PACKAGE_FEATURES):
+        for column in PACKAGE_FEATURE_COLUMNS.get(feature, ()):
+            if column in packages_df.columns:
+                matrix[:, i] = pd.to_numeric(packages_df[column], errors='coerce').to_numpy(dtype=np.float32)
+                break
+    if popularity_7d is not None:
+        matrix[:, PACKAGE_FEATURES.index('package_popularity_7d')] = popularity_7d
+    return matrix
+
+
+def recent_event_counts(package_positions, timestamps, n_packages, days=7, counts=None):
+    """
+    Events per package position in the `days` before the newest timestamp.
+
+    Returns a float array of n_packages, or None without usable timestamps.
+    Rows with a negative position are ignored; counts weighs aggregated rows.
+    """
+    timestamps = pd.Series(timestamps)
+    newest = timestamps.max()
+    if pd.isna(newest):
+        return None
+    recent = ((timestamps >= newest - pd.Timedelta(days=days)).to_numpy()
+              & (np.asarray(package_positions) >= 0))
+    weights = None if counts is None else np.asarray(counts, dtype=np.float64)[recent]
+    return np.bincount(np.asarray(package_positions)[recent], weights=weights,
+                       minlength=n_packages).astype(np.float64)
+
+
+def label_masks(df, side, vocabularies):
+    """
+    Label set bit masks (LABEL_FEATURES order) of each row of df.
+
+    Parameters:
+    -----------
+    df : DataFrame of users (side 0) or packages (side 1)
+    side : int
+        Index into the LABEL_FEATURE_COLUMNS pairs
+    vocabularies : dict
+        feature -> list of labels (bit i is label i); new labels are appended
+
+    Returns int64 (rows, 2); -1 where df lacks the column or the value.
+    """
+    masks = np.full((len(df), len(LABEL_FEATURES)), -1, dtype=np.int64)
+    for i, feature in enumerate(LABEL_FEATURES):
+        column = LABEL_FEATURE_COLUMNS[feature][side]
+        if column not in df.columns:
+            continue
+        vocabulary = vocabularies.setdefault(feature, [])
+        bits = {label: bit for bit, label in enumerate(vocabulary)}
+        for row, value in enumerate(df[column].astype(object)):
+            if pd.isna(value):
+                continue
+            mask = 0
+            for label in str(value).split('|'):
+                if label and label not in bits and len(vocabulary) < MAX_LABELS:
+                    bits[label] = len(vocabulary)
+                    vocabulary.append(label)
+                if label in bits:
+                    mask |= 1 << bits[label]
+            masks[row, i] = mask
+    return masks
+
+
+def label_overlap_features(user_masks, package_masks):
+    """
+    LABEL_FEATURES of (user, package) pairs from their label masks.
+
+    package_language_match is 1 if the user's language is among the
+    package's; user_pref_subjects_count_match counts shared subjects.
+    Pairs with an unknown set get NaN.
+    """
+    features = np.bitwise_count(user_masks & package_masks).astype(np.float64)
+    language = LABEL_FEATURES.index('package_language_match')
+    features[:, language] = features[:, language] > 0
+    features[(user_masks < 0) | (package_masks < 0)] = np.nan
+    return features
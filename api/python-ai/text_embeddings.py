@@ -0,0 +1,268 @@
+"""
+Deterministic text embeddings for packages.
+
+Package text (title, description, subjects, keywords) is hashed into a
+sparse term matrix with HashingVectorizer, weighted with TF-IDF and reduced
+to a fixed dimension with TruncatedSVD, all as batched sparse operations.
+
+The fitted IDF weights and projection are stored in the cache directory so
+later runs embed into the same space, and finished embeddings are cached by
+a hash of the package text: unchanged packages are never re-embedded.
+
+    models/text_embedder/
+        manifest.json       <- dims, n_features, corpus size at fit time
+        idf.npy             <- float32 (n_features,)
+        projection.npy      <- float32 (dims, n_features)
+        cache_keys.npy      <- sha1 of each cached text
+        cache_vectors.npy   <- float32 (cached texts, dims)
+
+Embeddings travel to training as one contiguous float32 matrix. CSV
+datasets can carry them in a binary sidecar next to packages.csv instead of
+the per-row JSON text_embedding column:
+
+    packages.csv
+    packages.embeddings.npy     <- float32 (packages, dims), CSV row order
+    packages.embeddings.json    <- package ids and the CSV size/mtime it matches
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.preprocessing import normalize
+
+from metrics import REGISTRY
+
+
+def package_texts(packages_df):
+    """Combine title, description, subjects and keywords into one lowercase text per package."""
+    def column(name):
+        if name not in packages_df.columns:
+            return pd.Series('', index=packages_df.index)
+        return packages_df[name].map(_as_text)
+
+    subjects = column('subjects' if 'subjects' in packages_df.columns else 'subject')
+    return (
+        column('title') + ' ' + column('description') + ' ' + subjects + ' ' + column('keywords')
+    ).str.lower()
+
+
+def _as_text(value):
+    """Lists (subjects, keywords) are joined with spaces; missing values become ''."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return ' '.join(str(v) for v in value)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    return str(value)
+
+
+class PackageEmbedder:
+    """TF-IDF + TruncatedSVD embedder with a persistent projection and content-hash cache."""
+
+    def __init__(self, cache_dir, dims=16, n_features=2**16):
+        self.cache_dir = Path(cache_dir)
+        self.dims = dims
+        self.n_features = n_features
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=(1, 2), alternate_sign=False, norm=None
+        )
+        self.idf = None
+        self.projection = None
+        self.cache = {}
+
+    def embed(self, texts, refit=False):
+        """
+        Embed texts as a float32 (len(texts), dims) matrix.
+
+        Fits the projection on `texts` if none is stored yet (or refit=True,
+        which also drops cached embeddings); otherwise only texts missing
+        from the cache are embedded, in one batched pass.
+        """
+        texts = list(texts)
+        if refit or not self._load():
+            self._fit(texts)
+
+        keys = [hashlib.sha1(text.encode('utf-8')).hexdigest() for text in texts]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        REGISTRY.increment('embedding_cache_total', len(keys) - len(missing), result='hit')
+        REGISTRY.increment('embedding_cache_total', len(missing), result='miss')
+        if missing:
+            first_text = dict(zip(keys, texts))
+            vectors = self._transform([first_text[key] for key in missing])
+            self.cache.update(zip(missing, vectors))
+            self._save_cache()
+
+        embeddings = np.empty((len(texts), self.dims), dtype=np.float32)
+        for i, key in enumerate(keys):
+            embeddings[i] = self.cache[key]
+        return embeddings
+
+    def _transform(self, texts):
+        tfidf = self._tfidf(texts)
+        return np.asarray(tfidf @ self.projection.T, dtype=np.float32)
+
+    def _tfidf(self, texts):
+        counts = self.vectorizer.transform(texts)
+        counts.data = 1.0 + np.log(counts.data)  # sublinear tf
+        return normalize(counts.multiply(self.idf).tocsr())
+
+    def _fit(self, texts):
+        """Fit IDF weights and the SVD projection on a corpus; clears the cache."""
+        counts = self.vectorizer.transform(texts)
+        tfidf = TfidfTransformer(sublinear_tf=True).fit(counts)
+        self.idf = tfidf.idf_.astype(np.float32)
+
+        # Small corpora support fewer components; the rest stay zero
+        projection = np.zeros((self.dims, self.n_features), dtype=np.float32)
+        n_components = min(self.dims, len(texts) - 1)
+        if n_components > 0:
+            svd = TruncatedSVD(n_components=n_components, random_state=42)
+            svd.fit(self._tfidf(texts))
+            projection[:n_components] = svd.components_
+        self.projection = projection
+        self.cache = {}
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        _save_array(self.cache_dir / 'idf.npy', self.idf)
+        _save_array(self.cache_dir / 'projection.npy', self.projection)
+        with open(self.cache_dir / 'manifest.json', 'w') as f:
+            json.dump({'dims': self.dims, 'n_features': self.n_features, 'n_fit_texts': len(texts)}, f, indent=2)
+        self._save_cache()
+
+    def _load(self):
+        """Load a stored projection matching dims/n_features; returns False if there is none."""
+        if self.projection is not None:
+            return True
+        try:
+            with open(self.cache_dir / 'manifest.json') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return False
+        if manifest['dims'] != self.dims or manifest['n_features'] != self.n_features:
+            return False
+
+        self.idf = np.load(self.cache_dir / 'idf.npy')
+        self.projection = np.load(self.cache_dir / 'projection.npy')
+        keys_path = self.cache_dir / 'cache_keys.npy'
+        if keys_path.exists():
+            keys = np.load(keys_path)
+            vectors = np.load(self.cache_dir / 'cache_vectors.npy')
+            self.cache = dict(zip(keys.tolist(), vectors))
+        return True
+
+    def _save_cache(self):
+        keys = list(self.cache)
+        vectors = (np.vstack([self.cache[key] for key in keys]) if keys
+                   else np.empty((0, self.dims), dtype=np.float32))
+        _save_array(self.cache_dir / 'cache_vectors.npy', vectors)
+        _save_array(self.cache_dir / 'cache_keys.npy', np.array(keys, dtype=str))
+
+
+def _save_array(path, array):
+    """np.save to a temporary file and rename it into place."""
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def parse_embedding_column(values):
+    """
+    Parse a text_embedding column into one float32 (rows, dims) matrix.
+
+    JSON-style strings ("[0.1, 0.2, ...]") are joined and parsed in a single
+    pass; arrays or lists are stacked. All rows must have the same length.
+    """
+    values = list(values)
+    if not values:
+        return np.empty((0, 0), dtype=np.float32)
+    if not all(isinstance(v, str) for v in values):
+        return np.vstack([np.asarray(json.loads(v) if isinstance(v, str) else v, dtype=np.float32)
+                          for v in values])
+
+    # Rows of different lengths could still add up to the right total, so check each row
+    dims = values[0].count(',') + 1
+    if not (pd.Series(values).str.count(',') == dims - 1).all():
+        raise ValueError(f"text_embedding rows must all have {dims} values")
+    text = ','.join(values).replace('[', '').replace(']', '')
+    flat = np.fromstring(text, dtype=np.float32, sep=',')
+    if flat.size != len(values) * dims:
+        raise ValueError(f"text_embedding rows must all have {dims} values")
+    return flat.reshape(len(values), dims)
+
+
+def sidecar_paths(csv_path):
+    """(matrix, manifest) paths of the embedding sidecar for a packages CSV."""
+    csv_path = Path(csv_path)
+    return (csv_path.with_name(f'{csv_path.stem}.embeddings.npy'),
+            csv_path.with_name(f'{csv_path.stem}.embeddings.json'))
+
+
+def write_embedding_sidecar(csv_path, package_ids, embeddings):
+    """Store embeddings (rows in CSV order) next to an already written packages CSV."""
+    matrix_path, manifest_path = sidecar_paths(csv_path)
+    stat = Path(csv_path).stat()
+    _save_array(matrix_path, np.ascontiguousarray(embeddings, dtype=np.float32))
+    tmp_path = manifest_path.with_name(f'.{manifest_path.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'csv_size': stat.st_size,
+            'csv_mtime_ns': stat.st_mtime_ns,
+            'package_ids': [str(p) for p in package_ids]
+        }, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def read_embedding_sidecar(csv_path, package_ids):
+    """
+    Embeddings for package_ids from the sidecar of a packages CSV.
+
+    Returns None if there is no sidecar, the CSV changed since it was
+    written, or it lacks some of the packages.
+    """
+    matrix_path, manifest_path = sidecar_paths(csv_path)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        stat = Path(csv_path).stat()
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if (manifest.get('csv_size'), manifest.get('csv_mtime_ns')) != (stat.st_size, stat.st_mtime_ns):
+        return None
+
+    matrix = np.load(matrix_path, allow_pickle=False)
+    stored_ids = manifest['package_ids']
+    package_ids = [str(p) for p in package_ids]
+    if len(matrix) != len(stored_ids):
+        return None
+    if package_ids == stored_ids:
+        return matrix
+    stored_index = pd.Index(stored_ids)
+    if not stored_index.is_unique:
+        return None
+    rows = stored_index.get_indexer(package_ids)
+    return None if (rows < 0).any() else matrix[rows]
+
+
+def load_package_embeddings(csv_path, packages_df, write_sidecar=True):
+    """
+    Embedding matrix for the rows of packages_df, read from csv_path.
+
+    Uses the sidecar when it is current; otherwise parses the text_embedding
+    column in one pass and (with write_sidecar) stores the sidecar for the
+    next run. Returns None if there are no embeddings at all.
+    """
+    embeddings = read_embedding_sidecar(csv_path, packages_df['package_id'])
+    if embeddings is not None:
+        return embeddings
+    if 'text_embedding' not in packages_df.columns:
+        return None
+    embeddings = parse_embedding_column(packages_df['text_embedding'])
+    if write_sidecar:
+        write_embedding_sidecar(csv_path, packages_df['package_id'], embeddings)
+    return embeddings
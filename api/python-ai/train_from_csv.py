@@ -10,9 +10,17 @@ import pandas as pd
 import numpy as np
 import json
 from hybrid_recommender import HybridRecommender
+from text_embeddings import load_package_embeddings
+from csv_loader import load_dataset_csv, load_dataset_events, TRAINING_COLUMNS
+import model_store
 
-def train_from_csv():
-    """Train model using CSV files from ML/recommender_dataset/"""
+def train_from_csv(train_ranker=False):
+    """
+    Train model using CSV files from ML/recommender_dataset/
+    
+    With train_ranker, also fit the second-stage re-ranker from
+    ranking_examples.csv.
+    """
     print("=" * 80)
     print("TRAINING HYBRID RECOMMENDATION MODEL FROM CSV")
     print("=" * 80)
@@ -31,20 +39,14 @@ def train_from_csv():
     
     # Load CSV files
     try:
-        users_df = pd.read_csv(data_dir / 'users.csv')
-        packages_df = pd.read_csv(data_dir / 'packages.csv')
-        events_df = pd.read_csv(data_dir / 'events.csv')
-        
-        # Rename columns to match expected format
-        if 'userId' in events_df.columns:
-            events_df = events_df.rename(columns={
-                'userId': 'user_id',
-                'eventType': 'event_type',
-                'packageId': 'package_id'
-            })
+        # Typed columns, parsed once and then read from the .typed.parquet copies
+        users_df = load_dataset_csv(data_dir, 'users.csv', columns=TRAINING_COLUMNS['users.csv'])
+        packages_df = load_dataset_csv(data_dir, 'packages.csv', columns=TRAINING_COLUMNS['packages.csv'])
+        # events.csv plus real events added by merge_real_data.py
+        events_df = load_dataset_events(data_dir)
         
-        if 'packageId' in packages_df.columns:
-            packages_df = packages_df.rename(columns={'packageId': 'package_id'})
+        # Binary sidecar next to packages.csv (written on the first run)
+        embeddings = load_package_embeddings(data_dir / 'packages.csv', packages_df)
         
         print(f"✓ Data loaded successfully:")
         print(f"  - Users: {len(users_df)}")
@@ -82,7 +84,9 @@ def train_from_csv():
     recommender = HybridRecommender()
     
     try:
-        recommender.train(users_df, packages_df, events_df)
+        recommender.train(users_df, packages_df, events_df, embeddings=embeddings)
+        if train_ranker:
+            recommender.fit_ranker(pd.read_csv(data_dir / 'ranking_examples.csv'))
     except Exception as e:
         print(f"❌ Error during training: {e}")
         import traceback
@@ -109,14 +113,14 @@ def train_from_csv():
     except Exception as e:
         print(f"⚠ Warning: Test failed but model is saved: {e}")
     
-    print("\n[5/5] Verifying model file...")
-    model_path = Path(__file__).parent / 'models' / 'hybrid_model.pkl'
-    if model_path.exists():
-        size_mb = model_path.stat().st_size / (1024 * 1024)
-        print(f"✓ Model file exists: {model_path}")
+    print("\n[5/5] Verifying model files...")
+    version = model_store.current_version(recommender.model_path)
+    if version is not None:
+        size_mb = model_store.version_size(recommender.model_path, version) / (1024 * 1024)
+        print(f"✓ Model version published: {recommender.model_path / version}")
         print(f"  Size: {size_mb:.2f} MB")
     else:
-        print(f"❌ Warning: Model file not found at {model_path}")
+        print(f"❌ Warning: No model version published in {recommender.model_path}")
         return False
     
     print("\n" + "=" * 80)
@@ -128,8 +132,15 @@ def train_from_csv():
     return True
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Train the hybrid recommendation model from CSV files')
+    parser.add_argument('--ranker', action='store_true',
+                        help='Also fit the re-ranking stage from ranking_examples.csv')
+    args = parser.parse_args()
+    
     try:
-        success = train_from_csv()
+        success = train_from_csv(train_ranker=args.ranker)
         sys.exit(0 if success else 1)
     except Exception as e:
         print(f"\n❌ Error training model: {str(e)}")
@@ -6,8 +6,9 @@ import os
 import sys
 from pathlib import Path
 import pandas as pd
-import pickle
+import numpy as np
 from hybrid_recommender import HybridRecommender
+import model_store
 
 def main():
     script_dir = Path(__file__).parent
@@ -53,40 +54,22 @@ def main():
     
     # Create text embeddings as simple vectors (TF-IDF will handle this)
     # For now, create dummy embeddings - the model will compute them
-    import json
-    packages_df['text_embedding'] = packages_df.apply(
-        lambda row: json.dumps([0.1] * 16),  # Dummy 16-dimensional vector
-        axis=1
-    )
+    embeddings = np.full((len(packages_df), 16), 0.1, dtype=np.float32)  # Dummy 16-dimensional vectors
     
     print(f"✓ Prepared {len(users_df)} users, {len(events_df)} events, {len(packages_df)} packages")
     
     # Train model
     print("\n[3/4] Training hybrid model...")
     model = HybridRecommender()
-    model.train(users_df, packages_df, events_df)
+    model.train(users_df, packages_df, events_df, embeddings=embeddings)
     print("✓ Model trained successfully")
     
     # Save model
-    model_path = script_dir / 'models' / 'hybrid_model.pkl'
-    model_path.parent.mkdir(exist_ok=True)
+    print(f"\n[4/4] Saving model to {model.model_path}...")
     
-    print(f"\n[4/4] Saving model to {model_path}...")
+    model.save_model()
     
-    # Save as dictionary (compatible with load_model method)
-    model_data = {
-        'svd': model.svd,
-        'interaction_matrix': model.interaction_matrix,
-        'predicted_scores_df': model.predicted_scores_df,
-        'content_similarity_df': model.content_similarity_df,
-        'packages_df': model.packages_df,
-        'event_weights': model.event_weights
-    }
-    
-    with open(model_path, 'wb') as f:
-        pickle.dump(model_data, f)
-    
-    size_mb = model_path.stat().st_size / (1024 * 1024)
+    size_mb = model_store.version_size(model.model_path, model.model_version) / (1024 * 1024)
     print(f"✓ Model saved ({size_mb:.2f} MB)")
     
     # Test the model
@@ -8,21 +8,55 @@ import os
 from pathlib import Path
 import pandas as pd
 import numpy as np
-import json
 from pymongo import MongoClient
 from dotenv import load_dotenv
-from hybrid_recommender import HybridRecommender
+from hybrid_recommender import HybridRecommender, EVENT_WEIGHTS, DEFAULT_EVENT_WEIGHT
+from event_store import EventStore, EVENT_COLUMNS, write_event_chunks
+from text_embeddings import PackageEmbedder, package_texts
+from factorization import FACTORIZATIONS
 
 # Load environment variables
 load_dotenv(Path(__file__).parent.parent / '.env')
 
-def connect_to_mongodb():
-    """Connect to MongoDB database."""
+EVENT_STORE_DIR = Path(__file__).parent / 'data' / 'event_store'
+TEXT_EMBEDDER_DIR = Path(__file__).parent / 'models' / 'text_embedder'
+
+def connect_to_mongodb(fixture=None):
+    """
+    Connect to MongoDB database.
+    
+    With fixture, returns an in-memory mongomock database loaded from that
+    JSON file instead, so exports can be run and checked offline.
+    """
+    if fixture is not None:
+        return load_fixture_database(fixture)
     mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/focusdesk')
     client = MongoClient(mongo_uri)
     db = client.get_database()
     return db
 
+def load_fixture_database(path):
+    """
+    In-memory stand-in database from a fixture file (requires mongomock).
+    
+    The file is one JSON object mapping collection names to lists of
+    documents in MongoDB extended JSON ({"$oid": ...}, {"$date": ...}), as
+    written by mongoexport --jsonArray or bson.json_util.dumps.
+    """
+    try:
+        import mongomock
+    except ImportError as e:
+        raise ImportError("Fixture databases require mongomock (pip install mongomock)") from e
+    from bson import json_util
+    
+    with open(path) as f:
+        collections = json_util.loads(f.read())
+    db = mongomock.MongoClient().get_database('focusdesk')
+    for name, documents in collections.items():
+        if documents:
+            db[name].insert_many(documents)
+    return db
+
 def export_users_data(db):
     """Export users from MongoDB to DataFrame."""
     users_collection = db['users']
@@ -43,8 +77,13 @@ def export_users_data(db):
     
     return users_df
 
-def export_packages_data(db):
-    """Export packages from MongoDB to DataFrame with text embeddings."""
+def export_packages_data(db, refit_embeddings=False):
+    """
+    Export packages from MongoDB with their text embeddings.
+    
+    Returns (packages_df, embeddings): embeddings is one float32 matrix in
+    packages_df row order, passed to training as is.
+    """
     packages_collection = db['packages']
     packages = list(packages_collection.find({}, {
         '_id': 1,
@@ -65,134 +104,280 @@ def export_packages_data(db):
             lambda x: x[0] if isinstance(x, list) and len(x) > 0 else 'General'
         )
         
-        # Generate text embeddings from title, description, and keywords
-        packages_df['text_embedding'] = packages_df.apply(
-            lambda row: generate_text_embedding(row), axis=1
-        )
+        # Embed title, description, subjects and keywords in one batch;
+        # packages whose text is unchanged come from the embedding cache
+        embedder = PackageEmbedder(TEXT_EMBEDDER_DIR)
+        embeddings = embedder.embed(package_texts(packages_df), refit=refit_embeddings)
         
-        packages_df = packages_df[['package_id', 'title', 'subject', 'rate', 'text_embedding']]
+        packages_df = packages_df[['package_id', 'title', 'subject', 'rate']]
     else:
-        packages_df = pd.DataFrame(columns=['package_id', 'title', 'subject', 'rate', 'text_embedding'])
+        packages_df = pd.DataFrame(columns=['package_id', 'title', 'subject', 'rate'])
+        embeddings = np.empty((0, 0), dtype=np.float32)
     
-    return packages_df
+    return packages_df, embeddings
+
+def activity_to_event(activity):
+    """Map an activities document (searches, views, clicks) to an event tuple."""
+    user_id = str(activity.get('studentId', ''))
+    package_id = (activity.get('details') or {}).get('packageId', '')
+    if not user_id or not package_id:
+        return None
+    return user_id, activity.get('type', 'view'), str(package_id), activity.get('timestamp')
+
+def booking_to_event(booking):
+    """Map a bookings document (strongest signal) to an event tuple."""
+    user_id = str(booking.get('studentId', ''))
+    package_id = str(booking.get('packageId', ''))
+    if not user_id or not package_id:
+        return None
+    # Map booking status to event type
+    status = booking.get('status', 'pending')
+    event_type = 'booking' if status in ['confirmed', 'completed'] else 'start_booking'
+    return user_id, event_type, package_id, booking.get('createdAt')
+
+def interaction_to_event(interaction):
+    """Map an interactions document to an event tuple."""
+    user_id = str(interaction.get('userId', ''))
+    package_id = (interaction.get('meta') or {}).get('packageId', '')
+    if not user_id or not package_id:
+        return None
+    return user_id, interaction.get('type', 'view'), str(package_id), interaction.get('timestamp')
 
-def generate_text_embedding(row):
-    """Generate a simple text embedding based on package features."""
-    # Simple embedding: create a 16-dimensional vector from text features
-    # In production, use proper embeddings (BERT, Word2Vec, etc.)
+# (collection, query, projection, document -> event tuple, timestamp field)
+EVENT_SOURCES = [
+    ('activities', {}, {
+        '_id': 0, 'studentId': 1, 'type': 1, 'details.packageId': 1, 'timestamp': 1
+    }, activity_to_event, 'timestamp'),
+    ('bookings', {}, {
+        '_id': 0, 'studentId': 1, 'packageId': 1, 'status': 1, 'createdAt': 1
+    }, booking_to_event, 'createdAt'),
+    ('interactions', {'type': {'$in': ['search', 'view', 'click']}}, {
+        '_id': 0, 'userId': 1, 'type': 1, 'meta.packageId': 1, 'timestamp': 1
+    }, interaction_to_event, 'timestamp'),
+]
+
+# Per collection: (user id field, package id field, event type expression)
+# for aggregated exports; the expressions mirror the *_to_event functions
+EVENT_SOURCE_FIELDS = {
+    'activities': ('studentId', 'details.packageId', {'$ifNull': ['$type', 'view']}),
+    'bookings': ('studentId', 'packageId', {
+        '$cond': [{'$in': ['$status', ['confirmed', 'completed']]}, 'booking', 'start_booking']
+    }),
+    'interactions': ('userId', 'meta.packageId', {'$ifNull': ['$type', 'view']}),
+}
+
+def aggregation_pipeline(name, query, time_field):
+    """
+    Pipeline that aggregates one collection to (user, package, type) rows in MongoDB.
     
-    title = str(row.get('title', '')).lower()
-    description = str(row.get('description', '')).lower()
-    keywords = row.get('keywords', [])
-    subject = str(row.get('subjects', [''])[0] if isinstance(row.get('subjects'), list) else '').lower()
+    Each output row has user_id, package_id, event_type, count (number of
+    events) and timestamp (the newest one), so one row crosses the wire per
+    user/package/type instead of one per event.
+    """
+    user_field, package_field, event_type = EVENT_SOURCE_FIELDS[name]
+    return [
+        {'$match': {**query, user_field: {'$nin': [None, '']}, package_field: {'$nin': [None, '']}}},
+        {'$project': {
+            '_id': 0,
+            'user_id': {'$toString': f'${user_field}'},
+            'package_id': {'$toString': f'${package_field}'},
+            'event_type': event_type,
+            'timestamp': f'${time_field}'
+        }},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'package_id': '$package_id', 'event_type': '$event_type'},
+            'count': {'$sum': 1},
+            'timestamp': {'$max': '$timestamp'}
+        }},
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id.user_id',
+            'package_id': '$_id.package_id',
+            'event_type': '$_id.event_type',
+            'count': 1,
+            'timestamp': 1
+        }},
+    ]
+
+def events_frame(user_ids, event_types, package_ids, timestamps):
+    """Build one columnar chunk of events, with weights mapped from event types."""
+    event_types = pd.Series(event_types, dtype=object)
+    return pd.DataFrame({
+        'user_id': user_ids,
+        'event_type': event_types,
+        'package_id': package_ids,
+        'timestamp': pd.to_datetime(timestamps, errors='coerce', utc=True),
+        'weight': event_types.map(EVENT_WEIGHTS).fillna(DEFAULT_EVENT_WEIGHT).to_numpy()
+    }, columns=EVENT_COLUMNS)
+
+def stream_event_chunks(collection, query, projection, to_event, batch_size):
+    """
+    Read a collection cursor in batches and yield DataFrame chunks of events.
     
-    # Combine text
-    all_text = f"{title} {description} {subject} {' '.join(keywords if isinstance(keywords, list) else [])}"
+    Only batch_size documents are held as Python objects at a time.
+    """
+    cursor = collection.find(query, projection, batch_size=batch_size)
+    columns = ([], [], [], [])
+    for document in cursor:
+        event = to_event(document)
+        if event is not None:
+            for column, value in zip(columns, event):
+                column.append(value)
+        if len(columns[0]) >= batch_size:
+            yield events_frame(*columns)
+            columns = ([], [], [], [])
+    if columns[0]:
+        yield events_frame(*columns)
+
+def export_events_data(db, batch_size=5000, spill_dir=None):
+    """
+    Export user interaction events from MongoDB.
     
-    # Create a simple hash-based embedding (16 dimensions)
-    # This is a placeholder - in production use proper NLP embeddings
-    np.random.seed(abs(hash(all_text)) % (2**32))
-    embedding = np.random.randn(16).tolist()
+    The activities, bookings and interactions collections are streamed
+    concurrently in batches. With spill_dir, each collection is written to
+    <spill_dir>/<collection>.parquet as it is read, so peak memory during
+    the export is bounded by batch_size.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def export_source(source):
+        name, query, projection, to_event, _ = source
+        chunks = stream_event_chunks(db[name], query, projection, to_event, batch_size)
+        if spill_dir is None:
+            return list(chunks)
+        path = Path(spill_dir) / f'{name}.parquet'
+        write_event_chunks(chunks, path)
+        return [pd.read_parquet(path)]
+    
+    if spill_dir is not None:
+        Path(spill_dir).mkdir(parents=True, exist_ok=True)
     
-    return json.dumps(embedding)
-
-def export_events_data(db):
-    """Export user interaction events from MongoDB."""
     # Combine data from activities, bookings, and interactions
-    events = []
-    
-    # 1. Get activities (searches, views, clicks)
-    activities_collection = db['activities']
-    activities = list(activities_collection.find({}, {
-        'studentId': 1,
-        'type': 1,
-        'details': 1,
-        'timestamp': 1
-    }))
+    with ThreadPoolExecutor(max_workers=len(EVENT_SOURCES)) as pool:
+        chunks = [chunk for source_chunks in pool.map(export_source, EVENT_SOURCES)
+                  for chunk in source_chunks]
     
-    for activity in activities:
-        user_id = str(activity.get('studentId', ''))
-        event_type = activity.get('type', 'view')
-        details = activity.get('details', {})
-        package_id = details.get('packageId', '')
-        
-        if user_id and package_id:
-            events.append({
-                'user_id': user_id,
-                'event_type': event_type,
-                'package_id': str(package_id)
-            })
-    
-    # 2. Get bookings (strongest signal)
-    bookings_collection = db['bookings']
-    bookings = list(bookings_collection.find({}, {
-        'studentId': 1,
-        'packageId': 1,
-        'status': 1,
-        'createdAt': 1
-    }))
+    chunks = [chunk for chunk in chunks if len(chunk) > 0]
+    if not chunks:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
     
-    for booking in bookings:
-        user_id = str(booking.get('studentId', ''))
-        package_id = str(booking.get('packageId', ''))
-        status = booking.get('status', 'pending')
-        
-        if user_id and package_id:
-            # Map booking status to event type
-            if status in ['confirmed', 'completed']:
-                event_type = 'booking'
-            else:
-                event_type = 'start_booking'
-            
-            events.append({
-                'user_id': user_id,
-                'event_type': event_type,
-                'package_id': package_id
-            })
-    
-    # 3. Get interactions
-    interactions_collection = db['interactions']
-    interactions = list(interactions_collection.find({'type': {'$in': ['search', 'view', 'click']}}, {
-        'userId': 1,
-        'type': 1,
-        'meta': 1
-    }))
+    events_df = pd.concat(chunks, ignore_index=True)
+    events_df['event_type'] = events_df['event_type'].astype('category')
+    return events_df
+
+def export_aggregated_events(db, batch_size=5000):
+    """
+    Export events pre-aggregated by MongoDB, one row per (user, package, type).
     
-    for interaction in interactions:
-        user_id = str(interaction.get('userId', ''))
-        event_type = interaction.get('type', 'view')
-        meta = interaction.get('meta', {})
-        package_id = meta.get('packageId', '')
-        
-        if user_id and package_id:
-            events.append({
-                'user_id': user_id,
-                'event_type': event_type,
-                'package_id': str(package_id)
-            })
+    Each collection runs aggregation_pipeline server-side; rows carry a count
+    column and the newest timestamp, and their weight is the type weight
+    times the count. Training treats a row as count events at that
+    timestamp (see interaction_weights.py).
+    """
+    from concurrent.futures import ThreadPoolExecutor
     
-    events_df = pd.DataFrame(events)
-    if events_df.empty:
-        events_df = pd.DataFrame(columns=['user_id', 'event_type', 'package_id'])
+    def export_source(source):
+        name, query, _, _, time_field = source
+        cursor = db[name].aggregate(aggregation_pipeline(name, query, time_field),
+                                    allowDiskUse=True, batchSize=batch_size)
+        rows = list(cursor)
+        if not rows:
+            return None
+        chunk = events_frame([r['user_id'] for r in rows], [r['event_type'] for r in rows],
+                             [r['package_id'] for r in rows], [r.get('timestamp') for r in rows])
+        chunk['count'] = np.array([r['count'] for r in rows], dtype=np.int64)
+        chunk['weight'] *= chunk['count']
+        return chunk
     
+    with ThreadPoolExecutor(max_workers=len(EVENT_SOURCES)) as pool:
+        chunks = [chunk for chunk in pool.map(export_source, EVENT_SOURCES) if chunk is not None]
+    
+    if not chunks:
+        return pd.DataFrame(columns=EVENT_COLUMNS + ['count'])
+    
+    events_df = pd.concat(chunks, ignore_index=True)
+    events_df['event_type'] = events_df['event_type'].astype('category')
     return events_df
 
-def train_and_save_model():
-    """Main function to train and save the recommendation model."""
+def export_new_events(db, store, batch_size=5000):
+    """
+    Export only events newer than each collection's watermark into the event store.
+    
+    Each collection is queried with a range filter on its timestamp field
+    (an index on activities.timestamp, bookings.createdAt and
+    interactions.timestamp keeps this cheap), appended to the store as a new
+    Parquet part, and its watermark advanced to the newest exported
+    timestamp. Returns the number of new events per collection.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    watermarks = store.watermarks()
+    
+    def export_source(source):
+        name, query, projection, to_event, time_field = source
+        watermark = watermarks.get(name)
+        if watermark is not None:
+            # MongoDB stores naive UTC datetimes
+            since = watermark.tz_convert('UTC').tz_localize(None).to_pydatetime()
+            query = {**query, time_field: {'$gt': since}}
+        
+        newest = []
+        def track_newest(chunks):
+            for chunk in chunks:
+                if chunk['timestamp'].notna().any():
+                    newest.append(chunk['timestamp'].max())
+                yield chunk
+        
+        chunks = stream_event_chunks(db[name], query, projection, to_event, batch_size)
+        rows = store.append_chunks(track_newest(chunks), name)
+        return name, rows, max(newest) if newest else None
+    
+    with ThreadPoolExecutor(max_workers=len(EVENT_SOURCES)) as pool:
+        results = list(pool.map(export_source, EVENT_SOURCES))
+    
+    # Advance watermarks only after every part is committed
+    store.save_watermarks({name: newest for name, _, newest in results if newest is not None})
+    return {name: rows for name, rows, _ in results}
+
+def train_and_save_model(batch_size=5000, spill_dir=None, incremental=False, refit_embeddings=False,
+                         factorization='svd', rank=20, factorization_params=None, interaction_weighting=None,
+                         n_anchors=1, aggregate=False, fixture=None, popularity_half_life_days=None):
+    """
+    Main function to train and save the recommendation model.
+    
+    With aggregate, events are grouped per user, package and type inside
+    MongoDB (export_aggregated_events); fixture reads a local mongomock
+    database from a JSON file instead of connecting to MongoDB.
+    interaction_weighting holds extra HybridRecommender.train arguments for
+    the interaction weights (interaction_half_life_days, event_type_caps,
+    burst_window_seconds); n_anchors is the number of strongest interactions
+    blended into each user's content query. popularity_half_life_days decays
+    the cold-start popularity ranking by event age.
+    """
     print("=" * 80)
     print("TRAINING HYBRID RECOMMENDATION MODEL")
     print("=" * 80)
     
     # Connect to MongoDB
     print("\n[1/5] Connecting to MongoDB...")
-    db = connect_to_mongodb()
+    db = connect_to_mongodb(fixture)
     print("✓ Connected to MongoDB")
     
     # Export data
     print("\n[2/5] Exporting data from MongoDB...")
     users_df = export_users_data(db)
-    packages_df = export_packages_data(db)
-    events_df = export_events_data(db)
+    packages_df, embeddings = export_packages_data(db, refit_embeddings=refit_embeddings)
+    if incremental:
+        # Fetch only new events; the full history comes from the local store
+        store = EventStore(EVENT_STORE_DIR)
+        new_events = export_new_events(db, store, batch_size=batch_size)
+        print(f"✓ New events since last export: {sum(new_events.values())} "
+              f"({', '.join(f'{name}: {rows}' for name, rows in new_events.items())})")
+        events_df = store.read()
+    elif aggregate:
+        events_df = export_aggregated_events(db, batch_size=batch_size)
+    else:
+        events_df = export_events_data(db, batch_size=batch_size, spill_dir=spill_dir)
     
     print(f"✓ Data exported:")
     print(f"  - Users: {len(users_df)}")
@@ -216,7 +401,9 @@ def train_and_save_model():
     # Train model
     print("\n[3/5] Training hybrid recommendation model...")
     recommender = HybridRecommender()
-    recommender.train(users_df, packages_df, events_df)
+    recommender.train(users_df, packages_df, events_df, factorization=factorization, rank=rank,
+                      factorization_params=factorization_params, n_anchors=n_anchors, embeddings=embeddings,
+                      popularity_half_life_days=popularity_half_life_days, **(interaction_weighting or {}))
     
     # Save model
     print("\n[4/5] Saving model to disk...")
@@ -237,8 +424,64 @@ def train_and_save_model():
     return True
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Train the hybrid recommendation model from MongoDB')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='Documents read per cursor batch during export')
+    parser.add_argument('--spill-dir', help='Stream exported events to Parquet files in this directory')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Export only events newer than the last export into the local event store')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='Group events per user, package and type in MongoDB before export')
+    parser.add_argument('--fixture', help='Use an in-memory database loaded from this JSON file (needs mongomock)')
+    parser.add_argument('--refit-embeddings', action='store_true',
+                        help='Refit the text embedding projection on the current packages')
+    parser.add_argument('--factorization', choices=sorted(FACTORIZATIONS), default='svd',
+                        help='Collaborative filtering backend (default: svd)')
+    parser.add_argument('--rank', type=int, default=20, help='Number of latent factors')
+    parser.add_argument('--iterations', type=int, help='ALS iterations (default: 15)')
+    parser.add_argument('--workers', type=int, help='ALS solver threads (default: all cores)')
+    parser.add_argument('--interaction-half-life', type=float,
+                        help='Decay interaction weights by event age with this half-life in days')
+    parser.add_argument('--popularity-half-life', type=float,
+                        help='Decay the cold-start popularity ranking by event age with this half-life in days')
+    parser.add_argument('--event-cap', action='append', default=[], metavar='TYPE=WEIGHT',
+                        help='Cap the summed weight of one event type per user and package (repeatable)')
+    parser.add_argument('--burst-seconds', type=float,
+                        help='Count repeated events on a package closer than this once')
+    parser.add_argument('--anchors', type=int, default=1,
+                        help="Strongest interactions blended into each user's content query (default: 1)")
+    args = parser.parse_args()
+    if args.aggregate and (args.incremental or args.spill_dir):
+        parser.error('--aggregate cannot be combined with --incremental or --spill-dir')
+    
+    factorization_params = {}
+    if args.iterations is not None:
+        factorization_params['iterations'] = args.iterations
+    if args.workers is not None:
+        factorization_params['n_jobs'] = args.workers
+    
+    event_type_caps = {}
+    for cap in args.event_cap:
+        event_type, _, weight = cap.partition('=')
+        event_type_caps[event_type] = float(weight)
+    interaction_weighting = {
+        'interaction_half_life_days': args.interaction_half_life,
+        'event_type_caps': event_type_caps,
+        'burst_window_seconds': args.burst_seconds
+    }
+    
     try:
-        success = train_and_save_model()
+        success = train_and_save_model(batch_size=args.batch_size, spill_dir=args.spill_dir,
+                                       incremental=args.incremental,
+                                       refit_embeddings=args.refit_embeddings,
+                                       factorization=args.factorization, rank=args.rank,
+                                       factorization_params=factorization_params,
+                                       interaction_weighting=interaction_weighting,
+                                       n_anchors=args.anchors, aggregate=args.aggregate,
+                                       fixture=args.fixture,
+                                       popularity_half_life_days=args.popularity_half_life)
         sys.exit(0 if success else 1)
     except Exception as e:
         print(f"\n❌ Error training model: {str(e)}")
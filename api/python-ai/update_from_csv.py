@@ -0,0 +1,72 @@
+"""
+Incrementally update the Hybrid Recommendation Model from new events
+Folds new activity into the published model instead of retraining from scratch
+
+Usage:
+    python update_from_csv.py new_events.csv [new_packages.csv]
+"""
+
+import sys
+from pathlib import Path
+import pandas as pd
+from hybrid_recommender import HybridRecommender
+from text_embeddings import load_package_embeddings
+import model_store
+
+def load_csv(path, renames):
+    """Load a CSV and rename camelCase export columns to the model's names."""
+    df = pd.read_csv(path)
+    return df.rename(columns={k: v for k, v in renames.items() if k in df.columns})
+
+def update_from_csv(events_path, packages_path=None):
+    """Load the published model, fold in new events, and publish a new version."""
+    print("=" * 80)
+    print("UPDATING HYBRID RECOMMENDATION MODEL")
+    print("=" * 80)
+
+    print(f"\n[1/3] Loading new data from {events_path}...")
+    events_df = load_csv(events_path, {
+        'userId': 'user_id',
+        'eventType': 'event_type',
+        'packageId': 'package_id'
+    })
+    packages_df = None
+    package_embeddings = None
+    if packages_path is not None:
+        packages_df = load_csv(packages_path, {'packageId': 'package_id'})
+        package_embeddings = load_package_embeddings(packages_path, packages_df)
+    print(f"✓ Loaded {len(events_df)} events"
+          + (f" and {len(packages_df)} packages" if packages_df is not None else ""))
+
+    print("\n[2/3] Updating model...")
+    recommender = HybridRecommender()
+    recommender.load_model()
+    previous_version = recommender.model_version
+    summary = recommender.update(events_df, packages_df, package_embeddings=package_embeddings)
+    print(f"✓ Updated from version {previous_version}:")
+    print(f"  - New users: {summary['newUsers']}")
+    print(f"  - New packages: {summary['newPackages']} (catalogue: {summary['newCataloguePackages']})")
+    print(f"  - Users refreshed: {summary['updatedUsers']}")
+
+    print("\n[3/3] Publishing new model version...")
+    recommender.save_model()
+    size_mb = model_store.version_size(recommender.model_path, recommender.model_version) / (1024 * 1024)
+    print(f"  Size: {size_mb:.2f} MB")
+
+    print("\n" + "=" * 80)
+    print("MODEL UPDATE COMPLETE!")
+    print("=" * 80)
+    return True
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python update_from_csv.py new_events.csv [new_packages.csv]")
+        sys.exit(1)
+    try:
+        success = update_from_csv(Path(sys.argv[1]), Path(sys.argv[2]) if len(sys.argv) > 2 else None)
+        sys.exit(0 if success else 1)
+    except Exception as e:
+        print(f"\n❌ Error updating model: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
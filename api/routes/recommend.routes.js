@@ -5,6 +5,7 @@ import {
   trackInteraction,
   getPersonalizedRecommendations,
   getSimilarPackages,
+  getMLMetrics,
   trainModel
 } from "../controllers/recommend.controller.js";
 import { verifyToken } from "../middleware/jwt.js";
@@ -27,6 +28,9 @@ router.get("/personalized", verifyToken, getPersonalizedRecommendations);
 // Get similar packages based on content similarity
 router.get("/similar/:packageId", getSimilarPackages);
 
+// ML service metrics as JSON, or Prometheus text with ?format=prometheus
+router.get("/ml-metrics", getMLMetrics);
+
 // Train/retrain the ML model (admin only - consider adding admin middleware)
 router.post("/train-model", trainModel);
 
@@ -18,14 +18,15 @@ if exist "venv\Scripts\activate.bat" (
     echo [1/3] Using system Python...
 )
 
-REM Backup old model
+REM Show the published model version (training keeps the last 3 under models\hybrid_model\)
 echo.
-echo [2/3] Backing up current model...
-if exist "models\hybrid_model.pkl" (
-    copy "models\hybrid_model.pkl" "models\hybrid_model_backup_%date:~-4,4%%date:~-10,2%%date:~-7,2%.pkl" >nul
-    echo     Backup created: hybrid_model_backup_%date:~-4,4%%date:~-10,2%%date:~-7,2%.pkl
+echo [2/3] Checking current model...
+if exist "models\hybrid_model\CURRENT" (
+    echo     Current model version:
+    type "models\hybrid_model\CURRENT"
+    echo.
 ) else (
-    echo     No existing model to backup
+    echo     No published model yet
 )
 
 REM Train new model
@@ -50,7 +51,7 @@ if %ERRORLEVEL% EQU 0 (
     echo Model Retraining Failed!
     echo ============================================
     echo.
-    echo The backup model is still available.
+    echo The previous model version is still published.
     echo Check the error messages above.
     echo.
 )